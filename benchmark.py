@@ -0,0 +1,672 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import sqlalchemy
+from sqlalchemy import select, and_, or_, func
+
+import model
+from model import *
+from replica import LocalReplica
+from journal import Journal
+
+WORDS = ['data', 'database', 'system', 'systems', 'concepts', 'structures', 'algorithms', 'network', 'networks',
+         'operating', 'compiler', 'design', 'theory', 'introduction', 'principles', 'modern', 'applied', 'analysis',
+         'distributed', 'parallel', 'computer', 'graphics', 'learning', 'machine', 'language', 'programming',
+         'logic', 'discrete', 'mathematics', 'history', 'physics', 'chemistry', 'biology', 'economics', 'novel']
+SURNAMES = ['smith', 'wang', 'li', 'zhang', 'garcia', 'mueller', 'tanaka', 'kim', 'silva', 'ivanov', 'weiss',
+            'knuth', 'tanenbaum', 'stallings', 'date', 'ullman', 'aho', 'sedgewick', 'cormen', 'patterson']
+PUBLISHERS = ['pearson', 'mcgraw', 'springer', 'wiley', 'oreilly', 'elsevier', 'mit press', 'cambridge',
+              'oxford', 'tsinghua']
+TYPES = ['textbook', 'novel', 'reference', 'journal', 'magazine']
+CARD_TYPES = ['student', 'teacher', 'staff', 'visitor']
+DEPTS = ['cs', 'math', 'physics', 'history', 'economics', 'biology', 'chemistry', 'law', 'medicine', 'arts']
+SEARCH_FILTERS = ['type', 'title', 'publisher', 'year', 'author', 'price']
+TEXT_QUERIES = ['data', 'data sys', 'netw', 'ullman']
+LIVE_PHRASES = ['distributed systems ullman', 'machine learning wiley', 'compiler design aho']
+
+
+def book_id(i):
+    return 'b{:08d}'.format(i)
+
+
+def card_id(i):
+    return 'c{:07d}'.format(i)
+
+
+def zipf_weights(count, skew=1.1):
+    # cumulative, so random.choices can draw from a million ranks without re-summing
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def skewed_ids(rng, count, cum_weights, make_id, k):
+    # popular ranks are scattered over the id space rather than packed at the start
+    return [make_id(rank * 7919 % count) for rank in rng.choices(range(count), cum_weights=cum_weights, k=k)]
+
+
+def count_loans(book_count, borrow_count, seed=0):
+    rng = random.Random(seed)
+    return Counter(skewed_ids(rng, book_count, zipf_weights(book_count), book_id, borrow_count))
+
+
+def generate_books(count, seed=0, start=0, loans=None):
+    rng = random.Random(seed)
+    loans = loans or {}
+    for i in range(start, start + count):
+        on_loan = loans.get(book_id(i), 0)
+        # popular titles are stocked deeper, but copies on loan still come out of stock
+        total = on_loan + rng.randint(1, 10)
+        yield {'id': book_id(i),
+               'type': rng.choice(TYPES),
+               'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))),
+               'publisher': rng.choice(PUBLISHERS),
+               'year': rng.randint(1950, 2020),
+               'author': rng.choice(SURNAMES),
+               'price': round(rng.uniform(5, 200), 2),
+               'total': total,
+               'stock': total - on_loan}
+
+
+def generate_cards(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {'id': card_id(i),
+               'name': 'reader {}'.format(i),
+               'dept': rng.choice(DEPTS),
+               'type': rng.choice(CARD_TYPES)}
+
+
+def generate_borrows(loans, card_count, seed=0):
+    rng = random.Random(seed)
+    card_weights = zipf_weights(card_count, skew=0.8)
+    today = date.today()
+    for book, count in sorted(loans.items()):
+        for card in skewed_ids(rng, card_count, card_weights, card_id, count):
+            borrowed = today - timedelta(days=rng.randint(0, 90))
+            yield {'card_id': card,
+                   'book_id': book,
+                   'admin_id': 'bench',
+                   'borrow_date': borrowed,
+                   'return_date': borrowed + timedelta(days=rng.randint(7, 120))}
+
+
+def insert_batches(table, rows, after=None, batch_size=5000):
+    for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+        with model.engine.begin() as connection:
+            connection.execute(table.insert(), batch)
+            if after is not None:
+                after(connection, batch)
+
+
+def table_size(table):
+    with model.engine.connect() as connection:
+        return connection.execute(select([func.count()]).select_from(table)).scalar()
+
+
+def load_library(book_count, card_count, borrow_count, seed=0):
+    sizes = (table_size(books), table_size(cards), table_size(borrows))
+    if sizes == (book_count, card_count, borrow_count):
+        return False
+    if any(sizes):
+        raise SystemExit('{!r} holds another data set ({} books, {} cards, {} borrows); '
+                         'pass --reload to replace it'.format(model.engine.url, *sizes))
+    loans = count_loans(book_count, borrow_count, seed)
+    with model.engine.begin() as connection:
+        connection.execute(admins.insert().values(id='bench', password='bench', name='bench', contact='bench'))
+    insert_batches(books, generate_books(book_count, seed, loans=loans), model._index_books)
+    insert_batches(cards, generate_cards(card_count, seed))
+    insert_batches(borrows, generate_borrows(loans, card_count, seed))
+    rebuild_circulation()
+    return True
+
+
+def clear_library():
+    with model.engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    search_cache.clear()
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(fraction * len(timings)))]
+
+
+def summarize(timings, elapsed=None, **extra):
+    summary = {'ops': len(timings),
+               'mean_ms': sum(timings) / len(timings) * 1000,
+               'p50_ms': percentile(timings, 0.5) * 1000,
+               'p95_ms': percentile(timings, 0.95) * 1000,
+               'p99_ms': percentile(timings, 0.99) * 1000,
+               'max_ms': max(timings) * 1000,
+               'ops_per_sec': len(timings) / (elapsed or sum(timings))}
+    summary.update(extra)
+    return summary
+
+
+def timed(func, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def sample_books(count, seed):
+    rng = random.Random(seed)
+    total = table_size(books)
+    ids = [book_id(rng.randrange(total)) for _ in range(count)]
+    with model.engine.connect() as connection:
+        return connection.execute(select([books]).where(books.c.id.in_(ids))).fetchall()
+
+
+def filter_params(combination, row):
+    params = {}
+    for attr in combination:
+        if attr == 'year':
+            params['year'] = (row.year - 5, row.year + 5)
+        elif attr == 'price':
+            params['price'] = (row.price - 10, row.price + 10)
+        else:
+            params[attr] = getattr(row, attr)
+    return params
+
+
+def bench_search(repeat, seed, page_size=50):
+    # every combination of the search page's filters, with values drawn from real rows
+    results = {}
+    samples = sample_books(repeat, seed)
+    for size in range(len(SEARCH_FILTERS) + 1):
+        for combination in itertools.combinations(SEARCH_FILTERS, size):
+            timings = timed(lambda params: search_books(page_size=page_size, use_cache=False, **params),
+                            [(filter_params(combination, row),) for row in samples])
+            results['search ' + ('+'.join(combination) or 'all')] = summarize(timings)
+    return results
+
+
+def offset_page(stmt, page, page_size):
+    # what keyset paging replaces: the database skips every earlier page's rows again
+    with model.engine.connect() as connection:
+        return connection.execute(stmt.limit(page_size).offset(page * page_size)).fetchall()
+
+
+def bench_deep_pages(repeat, depths=(1, 10, 100, 1000), page_size=50):
+    # one page deep into the catalog by title, fetched with its cursor and with OFFSET
+    cursors, cursor = {}, None
+    for page in range(1, max(depths) + 1):
+        cursor = search_books(order_by=books.c.title, page_size=page_size, cursor=cursor, use_cache=False).cursor
+        if cursor is None:
+            break
+        if page in depths:
+            cursors[page] = cursor
+    by_title = select([books]).order_by(books.c.title, books.c.id)
+    results = {}
+    for page, cursor in cursors.items():
+        results['search page {} by cursor'.format(page)] = summarize(timed(
+            lambda: search_books(order_by=books.c.title, page_size=page_size, cursor=cursor, use_cache=False),
+            [()] * repeat))
+        results['search page {} by offset'.format(page)] = summarize(timed(
+            lambda: offset_page(by_title, page, page_size), [()] * repeat))
+    return results
+
+
+def separate_facets(params, page_size):
+    # what faceted_search replaces: the search, then a count and one GROUP BY per facet
+    page = search_books(page_size=page_size, use_cache=False, **params)
+    source, scores = model._search_source(params.get('text'), params.get('text_mode', 'prefix'))
+    criteria = model._search_criteria(**{attr: params.get(attr) for attr in SEARCH_FILTERS})
+    where = and_(*criteria) if criteria else None
+    with model.engine.connect() as connection:
+        for name in ('*',) + model.FACETS:
+            if name == '*':
+                stmt = select([func.count()]).select_from(source)
+            else:
+                expression = model._facet_expression(name)
+                stmt = select([expression, func.count()]).select_from(source).group_by(expression) \
+                    .order_by(desc(func.count())).limit(20)
+            connection.execute(stmt if where is None else stmt.where(where)).fetchall()
+    return page
+
+
+def bench_facets(repeat, seed, page_size=50):
+    # the facet counts of a page that does not hold every match, over a few filter combinations
+    results = {}
+    samples = sample_books(repeat, seed)
+    for combination in [(), ('type',), ('year',), ('type', 'price')]:
+        args = [(filter_params(combination, row),) for row in samples]
+        name = '+'.join(combination) or 'all'
+        results['facets {} plain search'.format(name)] = summarize(timed(
+            lambda params: search_books(page_size=page_size, use_cache=False, **params), args))
+        results['facets {} combined'.format(name)] = summarize(timed(
+            lambda params: faceted_search(page_size=page_size, use_cache=False, **params), args))
+        results['facets {} separate queries'.format(name)] = summarize(timed(
+            lambda params: separate_facets(params, page_size), args))
+    return results
+
+
+def scan_search(text):
+    # the LIKE '%x%' fallback the text index replaces
+    criteria = []
+    for token in text.lower().split():
+        pattern = '%{}%'.format(token)
+        criteria.append(or_(books.c.title.like(pattern), books.c.author.like(pattern), books.c.publisher.like(pattern)))
+    with model.engine.connect() as connection:
+        return connection.execute(select([books]).where(and_(*criteria)).limit(50)).fetchall()
+
+
+def bench_text_search(queries, repeat):
+    results = {}
+    for text in queries:
+        for mode in model.TEXT_MODES:
+            results['text {} {!r}'.format(mode, text)] = summarize(timed(
+                lambda: search_books(text=text, text_mode=mode, page_size=50, use_cache=False), [()] * repeat))
+        results['text scan {!r}'.format(text)] = summarize(timed(lambda: scan_search(text), [()] * repeat))
+    return results
+
+
+def bench_live_search(phrases, page_size=200, debounce=0.25, budget=0.4):
+    # replays typing one character at a time, as the search page does after its debounce
+    latencies = []
+    refined = 0
+    for phrase in phrases:
+        last = None
+        for end in range(1, len(phrase) + 1):
+            params = {'text': phrase[:end], 'text_mode': 'prefix'}
+            start = time.perf_counter()
+            page = refine_search(*last, params) if last is not None else None
+            if page is None:
+                page = search_books(page_size=page_size, use_cache=False, **params)
+            else:
+                refined += 1
+            latencies.append(time.perf_counter() - start)
+            last = params, page
+    worst = debounce + max(latencies)
+    return {'live search': summarize(latencies, refined_locally=refined,
+                                     worst_keystroke_to_results_ms=worst * 1000,
+                                     within_budget=worst <= budget)}
+
+
+def bench_import(rows, seed, batch_size=1000):
+    # a throwaway feed under its own id prefix, removed again so the data set stays reusable
+    prefix = 'imp{}'.format(seed)
+    rng = random.Random(seed)
+    feed = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    with feed:
+        for i in range(rows):
+            feed.write('({}{:08d}, {}, {}, {}, {}, {}, {:.2f}, {})\n'.format(
+                prefix, i, rng.choice(TYPES), ' '.join(rng.choice(WORDS) for _ in range(3)),
+                rng.choice(PUBLISHERS), rng.randint(1950, 2020), rng.choice(SURNAMES),
+                rng.uniform(5, 200), rng.randint(1, 10)))
+    importer = BookImporter(feed.name, batch_size=batch_size)
+    try:
+        status = importer.run()
+    finally:
+        imported = select([books.c.id]).where(books.c.id.like(prefix + '%'))
+        with model.engine.begin() as connection:
+            for table in (book_terms, book_hashes):
+                connection.execute(table.delete().where(table.c.book_id.in_(imported)))
+            connection.execute(books.delete().where(books.c.id.like(prefix + '%')))
+            connection.execute(import_checkpoints.delete().where(import_checkpoints.c.source == importer.source))
+        for path in (feed.name, importer.reject_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return {'import books': {'rows': status.imported,
+                             'rejected': status.rejected,
+                             'batch_size': batch_size,
+                             'seconds': status.elapsed,
+                             'rows_per_sec': status.rate}}
+
+
+def bench_circulation(clients, operations, seed):
+    # each desk checks out a skewed title and hands it straight back, so popular titles contend
+    book_count = table_size(books)
+    card_count = table_size(cards)
+    weights = zipf_weights(book_count)
+    admin = Admin(id='bench')
+    lock = threading.Lock()
+    borrow_times, return_times = [], []
+    refused = []
+
+    def desk(number):
+        rng = random.Random(seed + number)
+        due = date.today() + timedelta(days=14)
+        for target in skewed_ids(rng, book_count, weights, book_id, operations):
+            card = card_id(rng.randrange(card_count))
+            start = time.perf_counter()
+            try:
+                admin.borrow_book(card, target, due)
+            except ForbiddenOperationError:
+                with lock:
+                    refused.append(target)
+                continue
+            borrowed = time.perf_counter()
+            admin.return_book(card, target)
+            returned = time.perf_counter()
+            with lock:
+                borrow_times.append(borrowed - start)
+                return_times.append(returned - borrowed)
+
+    threads = [threading.Thread(target=desk, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'borrow book': summarize(borrow_times, elapsed, clients=clients, refused=len(refused)),
+            'return book': summarize(return_times, elapsed, clients=clients)}
+
+
+def bench_list_borrows(repeat, seed, heavy_loans=5000, page_size=50):
+    rng = random.Random(seed)
+    card_count = table_size(cards)
+    book_count = table_size(books)
+    busiest = select([borrows.c.card_id]).group_by(borrows.c.card_id).order_by(func.count().desc()).limit(repeat)
+    with model.engine.connect() as connection:
+        heavy = [(row.card_id,) for row in connection.execute(busiest)]
+        depts = [row.dept for row in connection.execute(select([cards.c.dept]).distinct()) if row.dept is not None]
+    results = {'list borrows': summarize(timed(Admin.list_borrows,
+                                               [(card_id(rng.randrange(card_count)),) for _ in range(repeat)])),
+               'list borrows busiest cards': summarize(timed(Admin.list_borrows, heavy)),
+               'list borrows family of 4': summarize(timed(
+                   lambda ids: Admin.list_borrows(card_ids=ids),
+                   [([card_id(rng.randrange(card_count)) for _ in range(4)],) for _ in range(repeat)])),
+               'list borrows dept page': summarize(timed(
+                   lambda dept: Admin.list_borrows(dept=dept, page_size=page_size),
+                   [(rng.choice(depts),) for _ in range(repeat)]))}
+
+    # borrows only holds outstanding loans, so a card with thousands of them is made for the measurement
+    today = date.today()
+    loans = []
+    for _ in range(heavy_loans):
+        borrowed = today - timedelta(days=rng.randint(0, 150))
+        loans.append({'card_id': 'heavy', 'book_id': book_id(rng.randrange(book_count)), 'admin_id': 'bench',
+                      'borrow_date': borrowed, 'return_date': borrowed + timedelta(days=rng.randint(7, 120))})
+    with model.engine.begin() as connection:
+        connection.execute(cards.insert().values(id='heavy', name='heavy reader', dept=None, type='teacher'))
+        connection.execute(borrows.insert(), loans)
+    try:
+        def walk():
+            cursor = None
+            while True:
+                page = Admin.list_borrows('heavy', page_size=page_size, cursor=cursor)
+                cursor = page.cursor
+                if cursor is None:
+                    return
+
+        loans = select([borrows.c.id.label('borrow_id'), books, borrows.c.borrow_date, borrows.c.return_date,
+                        borrows.c.admin_id]) \
+            .select_from(borrows.join(books)).where(borrows.c.card_id == 'heavy') \
+            .order_by(borrows.c.return_date, borrows.c.id)
+
+        def walk_by_offset():
+            page = 0
+            while len(offset_page(loans, page, page_size)) == page_size:
+                page += 1
+
+        results['list borrows {} loans'.format(heavy_loans)] = summarize(timed(Admin.list_borrows,
+                                                                               [('heavy',)] * repeat))
+        results['list borrows {} loans first page'.format(heavy_loans)] = summarize(timed(
+            lambda: Admin.list_borrows('heavy', page_size=page_size), [()] * repeat))
+        results['list borrows {} loans every page'.format(heavy_loans)] = summarize(timed(walk, [()] * 3))
+        results['list borrows {} loans every page by offset'.format(heavy_loans)] = summarize(timed(
+            walk_by_offset, [()] * 3))
+    finally:
+        with model.engine.begin() as connection:
+            connection.execute(borrows.delete().where(borrows.c.card_id == 'heavy'))
+            connection.execute(cards.delete().where(cards.c.id == 'heavy'))
+    return results
+
+
+def bench_nearest_return(repeat, seed):
+    rng = random.Random(seed)
+    book_count = table_size(books)
+    targets = skewed_ids(rng, book_count, zipf_weights(book_count), book_id, repeat)
+    return {'find nearest return': summarize(timed(Admin.find_nearest_return, [(target,) for target in targets]))}
+
+
+def retained_bytes(func, *args, **kwargs):
+    # memory still held by the result once it is built
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_columnar(repeat, type='textbook'):
+    # a result held as row objects and re-sorted by the database, against one held in columns and sorted in memory
+    # the first run of each compiles statements and fills caches that would count against it
+    search_books(type=type, use_cache=False)
+    search_books(type=type, use_cache=False, columnar=True)
+    rows, row_bytes = retained_bytes(lambda: search_books(type=type, use_cache=False).rows)
+    count = len(rows)
+    del rows
+    columns, column_bytes = retained_bytes(lambda: search_books(type=type, use_cache=False, columnar=True).rows)
+    orders = [('year', False), ('price', True), ('title', False), ('publisher', False)]
+    database = [(getattr(books.c, name) if not descending else desc(getattr(books.c, name)),) for name, descending
+                in itertools.islice(itertools.cycle(orders), repeat)]
+    local = [([order, ('id', False)],) for order in itertools.islice(itertools.cycle(orders), repeat)]
+    return {'result memory': {'rows': count,
+                              'row_bytes_per_row': row_bytes / count if count else 0.0,
+                              'column_bytes_per_row': column_bytes / count if count else 0.0},
+            're-sort in database': summarize(timed(lambda order_by: search_books(type=type, order_by=order_by,
+                                                                                 use_cache=False), database)),
+            're-sort in memory': summarize(timed(columns.sort, local)),
+            'narrow in memory': summarize(timed(lambda low: columns.filter(year=(low, low + 10)),
+                                                [(1950 + 5 * (i % 12),) for i in range(repeat)])),
+            'count in memory': summarize(timed(columns.group_count, [('publisher',)] * repeat))}
+
+
+def bench_statement_cache(calls, seed):
+    # per-call cost of the hot lookups when their statements are built and compiled every time, and when cached
+    rng = random.Random(seed)
+    book_count = table_size(books)
+    card_count = table_size(cards)
+    rows = sample_books(100, seed)
+    cases = {'search by type and years': (lambda row: search_books(type=row.type, year=(row.year - 5, row.year + 5),
+                                                                   page_size=20, use_cache=False),
+                                          [(rng.choice(rows),) for _ in range(calls)]),
+             'search by keyword': (lambda row: search_books(text=row.title.split()[0], page_size=20, use_cache=False),
+                                   [(rng.choice(rows),) for _ in range(calls)]),
+             'list borrows': (Admin.list_borrows, [(card_id(rng.randrange(card_count)),) for _ in range(calls)]),
+             'find nearest return': (Admin.find_nearest_return,
+                                     [(book_id(rng.randrange(book_count)),) for _ in range(calls)])}
+    results = {}
+    cache = model.statement_cache
+    try:
+        for label, statements in (('rebuilt', StatementCache(max_entries=0)), ('cached', StatementCache())):
+            model.statement_cache = statements
+            for name, (call, args_list) in cases.items():
+                call(*args_list[0])
+                results['{} {}'.format(name, label)] = summarize(timed(call, args_list))
+        results['statement cache'] = statements.stats()
+    finally:
+        model.statement_cache = cache
+    return results
+
+
+def bench_journal(operations, seed):
+    # what journaling adds to a checkout: nothing, a queue put for the writer thread, or an insert in its transaction
+    rng = random.Random(seed)
+    admin = Admin(id='bench')
+    card_count = table_size(cards)
+    available = [row.id for row in sample_books(operations * 2, seed) if row.stock > 0]
+    due = date.today() + timedelta(days=14)
+    results = {}
+    previous = model.journal
+    try:
+        for mode in ('off', 'batched', 'sync'):
+            model.journal = Journal(store_events, mode=mode)
+            loans = [(card_id(rng.randrange(card_count)), book) for book in rng.sample(available,
+                                                                                   min(operations, len(available)))]
+            timings = timed(lambda card, book: admin.borrow_book(card, book, due), loans)
+            timed(Admin.return_book, loans)
+            start = time.perf_counter()
+            model.journal.flush()
+            results['borrow book journal {}'.format(mode)] = summarize(
+                timings, flush_ms=(time.perf_counter() - start) * 1000, **model.journal.stats())
+    finally:
+        model.journal = previous
+    baseline = results['borrow book journal off']
+    for mode in ('batched', 'sync'):
+        summary = results['borrow book journal {}'.format(mode)]
+        summary['added_p50_ms'] = summary['p50_ms'] - baseline['p50_ms']
+        summary['added_p95_ms'] = summary['p95_ms'] - baseline['p95_ms']
+    return results
+
+
+STARTUP_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import model
+imported = time.perf_counter()
+model.configure(sys.argv[1])
+model.prepare_db()
+prepared = time.perf_counter()
+model.search_books(page_size=50, use_cache=False)
+queried = time.perf_counter()
+model.prepare_db(force=True)
+print(json.dumps({'import model': imported - start,
+                  'prepare db': prepared - imported,
+                  'first query': queried - start,
+                  'prepare db unstamped': time.perf_counter() - queried}))
+'''
+
+
+def first_frame(url, timeout=120):
+    # the app prints a line once its first frame is drawn; None when Kivy can't run here
+    env = dict(os.environ, LIBRARY_DB_URL=url, LIBRARY_EXIT_AFTER_FIRST_FRAME='1')
+    start = time.perf_counter()
+    try:
+        process = subprocess.run([sys.executable, 'library.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    if 'first frame' not in process.stdout:
+        return None
+    return time.perf_counter() - start
+
+
+def bench_startup(url, repeat):
+    # each sample is a fresh interpreter, so imports and connections start cold
+    timings = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, url], check=True, stdout=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).stdout
+        timings.setdefault('process to first query', []).append(time.perf_counter() - start)
+        for name, seconds in json.loads(output.splitlines()[-1]).items():
+            timings.setdefault(name, []).append(seconds)
+        frame = first_frame(url)
+        if frame is not None:
+            timings.setdefault('process to first frame', []).append(frame)
+    return {'startup ' + name: summarize(samples) for name, samples in timings.items()}
+
+
+def bench_replica_sync(changes, seed):
+    # a cold start pulls the whole catalog; after that a terminal only fetches what the change log names
+    rng = random.Random(seed)
+    book_count = table_size(books)
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        replica = LocalReplica(path)
+        start = time.perf_counter()
+        pulled = replica.sync()
+        full_seconds = time.perf_counter() - start
+        touched = skewed_ids(rng, book_count, zipf_weights(book_count), book_id, changes)
+        with model.engine.begin() as connection:
+            model._log_changes(connection, 'books', set(touched))
+        start = time.perf_counter()
+        fetched = replica.sync()
+        delta_seconds = time.perf_counter() - start
+        replica.engine.dispose()
+    finally:
+        os.remove(path)
+    return {'replica full pull': {'books': pulled, 'seconds': full_seconds},
+            'replica delta sync': {'books': fetched, 'seconds': delta_seconds}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the library model')
+    parser.add_argument('--url', default='sqlite:///benchmark.db')
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--cards', type=int, default=200000)
+    parser.add_argument('--borrows', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reload', action='store_true', help='drop the existing rows and generate them again')
+    parser.add_argument('--repeat', type=int, default=20, help='samples per scenario')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent desks borrowing and returning')
+    parser.add_argument('--operations', type=int, default=50, help='checkouts per desk')
+    parser.add_argument('--import-rows', type=int, default=100000)
+    parser.add_argument('--heavy-loans', type=int, default=5000, help='outstanding loans on the heaviest card')
+    parser.add_argument('--statement-calls', type=int, default=2000, help='calls per statement cache scenario')
+    parser.add_argument('--journal-operations', type=int, default=200, help='checkouts per journal mode')
+    parser.add_argument('--replica-changes', type=int, default=1000, help='books changed between replica syncs')
+    parser.add_argument('--budget', type=float, default=400,
+                        help='live search keystroke-to-results budget in ms, debounce included')
+    parser.add_argument('--output', default='benchmark.json', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    configure(args.url)
+    prepare_db()
+    if args.reload:
+        clear_library()
+    start = time.perf_counter()
+    generated = load_library(args.books, args.cards, args.borrows, args.seed)
+    load_seconds = time.perf_counter() - start
+
+    results = {}
+    results.update(bench_startup(args.url, min(args.repeat, 10)))
+    results.update(bench_search(args.repeat, args.seed))
+    results.update(bench_deep_pages(args.repeat))
+    results.update(bench_text_search(TEXT_QUERIES, args.repeat))
+    results.update(bench_facets(args.repeat, args.seed))
+    results.update(bench_live_search(LIVE_PHRASES, budget=args.budget / 1000))
+    results.update(bench_import(args.import_rows, args.seed))
+    results.update(bench_circulation(args.clients, args.operations, args.seed))
+    results.update(bench_list_borrows(args.repeat, args.seed, args.heavy_loans))
+    results.update(bench_nearest_return(args.repeat, args.seed))
+    results.update(bench_columnar(args.repeat))
+    results.update(bench_statement_cache(args.statement_calls, args.seed))
+    results.update(bench_journal(args.journal_operations, args.seed))
+    results.update(bench_replica_sync(args.replica_changes, args.seed))
+
+    for name, metrics in results.items():
+        print('{:<40} {}'.format(name, '  '.join('{} {:.2f}'.format(key, value) if isinstance(value, float)
+                                                 else '{} {}'.format(key, value)
+                                                 for key, value in metrics.items())))
+    report = {'meta': {'url': repr(model.engine.url),
+                       'dialect': model.engine.dialect.name,
+                       'books': args.books,
+                       'cards': args.cards,
+                       'borrows': args.borrows,
+                       'seed': args.seed,
+                       'generated': generated,
+                       'load_seconds': load_seconds,
+                       'started': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'sqlalchemy': sqlalchemy.__version__},
+              'scenarios': results}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
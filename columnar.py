@@ -0,0 +1,348 @@
+"""Search results stored column by column.
+
+A BookColumns keeps each column of a result in one array rather than one
+Python object per row: ids and titles as lists, type, publisher and author as
+codes into a table of their distinct values, year, total and stock as integer
+arrays and price as an array of cents.  Sorting, narrowing and counting work
+on the arrays, with NumPy when it is installed and the array module otherwise,
+and return new BookColumns; row objects are only built when iterated.
+
+Comparisons follow the database: strings match and sort case-insensitively,
+and nulls sort before every value.
+"""
+from array import array
+from collections import Counter, namedtuple
+from decimal import Decimal
+from functools import lru_cache
+import math
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['BookColumns']
+
+
+def _ints(values, typecode='q'):
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int32 if typecode == 'i' else numpy.int64)
+    return array(typecode, values)
+
+
+def _mask(flags):
+    if numpy is not None:
+        return numpy.array(list(flags), dtype=bool)
+    return array('b', flags)
+
+
+def _both(mask, other):
+    if numpy is not None:
+        return mask & other
+    return [a and b for a, b in zip(mask, other)]
+
+
+def _positions(mask):
+    if numpy is not None:
+        return numpy.flatnonzero(mask)
+    return [i for i, flag in enumerate(mask) if flag]
+
+
+def _pick(values, indices):
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values[indices]
+    if isinstance(values, array):
+        return array(values.typecode, [values[i] for i in indices])
+    return [values[i] for i in indices]
+
+
+def _plain(values):
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values.tolist()
+    return list(values)
+
+
+def _collate(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _ranks(values):
+    # the position of each value among the distinct values in sort order, -1 for null
+    distinct = sorted({value for value in values if value is not None}, key=_collate)
+    rank = {value: i for i, value in enumerate(distinct)}
+    rank[None] = -1
+    return _ints([rank[value] for value in values])
+
+
+def _same_text(value, wanted):
+    return value is not None and value.casefold() == wanted.casefold()
+
+
+class ObjectColumn:
+    """Values kept as they are, for columns with few repeats such as ids and titles."""
+
+    def __init__(self, values):
+        self.data = values
+        self._sort_keys = None
+
+    @classmethod
+    def build(cls, values):
+        return cls(list(values))
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def values(self):
+        return self.data
+
+    def take(self, indices):
+        return type(self)(_pick(self.data, indices))
+
+    def sort_keys(self):
+        if self._sort_keys is None:
+            self._sort_keys = _ranks(self.data)
+        return self._sort_keys
+
+    def matches(self, wanted):
+        return _mask(_same_text(value, wanted) for value in self.data)
+
+    def counts(self):
+        return Counter(self.data)
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.data) + sum(sys.getsizeof(value) for value in self.data if value is not None)
+
+
+class CategoryColumn:
+    """Codes into a shared table of distinct values; code 0 is null."""
+
+    def __init__(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+        self._sort_keys = None
+
+    @classmethod
+    def build(cls, values):
+        index = {None: 0}
+        codes = [index.setdefault(value, len(index)) for value in values]
+        return cls(_ints(codes, 'i'), list(index))
+
+    def __getitem__(self, i):
+        return self.labels[self.codes[i]]
+
+    def values(self):
+        labels = self.labels
+        return [labels[code] for code in _plain(self.codes)]
+
+    def take(self, indices):
+        return type(self)(_pick(self.codes, indices), self.labels)
+
+    def sort_keys(self):
+        if self._sort_keys is None:
+            ranks = _ranks(self.labels)
+            if numpy is not None:
+                self._sort_keys = ranks[self.codes]
+            else:
+                self._sort_keys = array('q', [ranks[code] for code in self.codes])
+        return self._sort_keys
+
+    def matches(self, wanted):
+        codes = [code for code, label in enumerate(self.labels) if _same_text(label, wanted)]
+        if numpy is not None:
+            return numpy.isin(self.codes, codes)
+        codes = set(codes)
+        return [code in codes for code in self.codes]
+
+    def counts(self):
+        if numpy is not None:
+            found = numpy.bincount(self.codes, minlength=len(self.labels)).tolist()
+        else:
+            found = [0] * len(self.labels)
+            for code in self.codes:
+                found[code] += 1
+        return Counter({self.labels[code]: count for code, count in enumerate(found) if count})
+
+    @property
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + sys.getsizeof(self.labels) + \
+            sum(sys.getsizeof(label) for label in self.labels if label is not None)
+
+
+class IntColumn:
+    """Integers, with a null flag per row when any value is null."""
+    scale = 0
+
+    def __init__(self, data, nulls=None):
+        self.data = data
+        self.nulls = nulls
+
+    @classmethod
+    def build(cls, values):
+        values = list(values)
+        nulls = [value is None for value in values]
+        data = _ints([0 if value is None else cls.encode(value) for value in values])
+        return cls(data, _mask(nulls) if any(nulls) else None)
+
+    @classmethod
+    def encode(cls, value):
+        return int(value)
+
+    def decode(self, value):
+        return value
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.decode(int(self.data[i]))
+
+    def values(self):
+        values = [self.decode(value) for value in _plain(self.data)] if self.scale else _plain(self.data)
+        if self.nulls is None:
+            return values
+        return [None if null else value for value, null in zip(values, _plain(self.nulls))]
+
+    def take(self, indices):
+        return type(self)(_pick(self.data, indices), None if self.nulls is None else _pick(self.nulls, indices))
+
+    def sort_keys(self):
+        if self.nulls is None:
+            return self.data
+        # nulls take a value below every other one
+        if numpy is not None:
+            return numpy.where(self.nulls, self.data.min(initial=0) - 1, self.data)
+        low = min(self.data, default=0) - 1
+        return array('q', [low if null else value for value, null in zip(self.data, self.nulls)])
+
+    def _bound(self, value, rounding):
+        return rounding(Decimal(str(value)).scaleb(self.scale))
+
+    def matches(self, bounds):
+        # a single value or an inclusive (low, high) range, like search_books
+        low, high = bounds if isinstance(bounds, (tuple, list)) else (bounds, bounds)
+        low, high = self._bound(low, math.ceil), self._bound(high, math.floor)
+        if numpy is not None:
+            mask = (self.data >= low) & (self.data <= high)
+            return mask if self.nulls is None else mask & ~self.nulls
+        if self.nulls is None:
+            return [low <= value <= high for value in self.data]
+        return [low <= value <= high and not null for value, null in zip(self.data, self.nulls)]
+
+    def counts(self):
+        return Counter(self.values())
+
+    @property
+    def nbytes(self):
+        size = self.data.itemsize * len(self.data)
+        if self.nulls is not None:
+            size += self.nulls.itemsize * len(self.nulls)
+        return size
+
+
+class DecimalColumn(IntColumn):
+    """Fixed-point numbers stored as whole hundredths, the scale of books.price."""
+    scale = 2
+
+    @classmethod
+    def encode(cls, value):
+        return int(Decimal(str(value)).scaleb(cls.scale).to_integral_value())
+
+    def decode(self, value):
+        return Decimal(value).scaleb(-self.scale)
+
+
+LAYOUT = {
+    'type': CategoryColumn,
+    'publisher': CategoryColumn,
+    'author': CategoryColumn,
+    'year': IntColumn,
+    'price': DecimalColumn,
+    'total': IntColumn,
+    'stock': IntColumn,
+}
+
+
+@lru_cache(maxsize=32)
+def _record_type(names):
+    return namedtuple('BookRecord', names)
+
+
+class BookColumns:
+    """An immutable result set that sorts, narrows and counts without going back to the database.
+
+    Iterating yields named tuples, so it stands in for a list of rows.
+    """
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+        self.record = _record_type(tuple(columns))
+
+    @classmethod
+    def from_rows(cls, rows, names):
+        rows = list(rows)
+        names = list(names)
+        data = list(zip(*rows)) if rows else [()] * len(names)
+        return cls({name: LAYOUT.get(name, ObjectColumn).build(values) for name, values in zip(names, data)},
+                   len(rows))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return map(self.record._make, zip(*(column.values() for column in self.columns.values())))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(self.length)))
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('row {} out of range'.format(i))
+        return self.record._make(column[i] for column in self.columns.values())
+
+    def keys(self):
+        return list(self.columns)
+
+    def values(self, name):
+        return self.columns[name].values()
+
+    def take(self, indices):
+        if numpy is not None:
+            indices = numpy.asarray(indices, dtype=numpy.intp)
+        return BookColumns({name: column.take(indices) for name, column in self.columns.items()}, len(indices))
+
+    def order(self, keys):
+        """Return the row positions sorted by `keys`, a list of (name, descending), stably."""
+        keys = list(keys)
+        if numpy is not None:
+            arrays = [-self.columns[name].sort_keys() if descending else self.columns[name].sort_keys()
+                      for name, descending in keys]
+            # lexsort sorts by the last array first
+            return numpy.lexsort(arrays[::-1]) if arrays else numpy.arange(self.length)
+        positions = list(range(self.length))
+        for name, descending in reversed(keys):
+            positions.sort(key=self.columns[name].sort_keys().__getitem__, reverse=descending)
+        return positions
+
+    def sort(self, keys):
+        return self.take(self.order(keys))
+
+    def filter(self, **criteria):
+        """Keep the rows matching search_books style criteria: exact strings, numeric values or ranges."""
+        mask = None
+        for name, wanted in criteria.items():
+            matched = self.columns[name].matches(wanted)
+            mask = matched if mask is None else _both(mask, matched)
+        if mask is None:
+            return self
+        return self.take(_positions(mask))
+
+    def group_count(self, name):
+        """Count the rows per value of column `name`."""
+        return self.columns[name].counts()
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
@@ -0,0 +1,48 @@
+"""Fixtures shared by the test modules.
+
+`library` is a fresh SQLite library under the test's tmp_path holding the desk
+admin and whatever rows the test module lists in CARDS, BOOKS and BORROWS; the
+books are put in the keyword index too.  It returns the desk Admin.  Indirect
+parametrization passes extra `configure` options, e.g. a slow query threshold.
+`shared_library` is the same, built once for the whole module.
+"""
+import pytest
+
+import model
+from model import *
+
+
+def _open_library(path, module, options):
+    url = 'sqlite:///{}'.format(path)
+    configure(url, **options)
+    prepare_db()
+    with model.engine.begin() as connection:
+        connection.execute(admins.insert().values(id='desk', password='nopass', name='desk', contact='desk'))
+        for table, name in ((cards, 'CARDS'), (books, 'BOOKS'), (borrows, 'BORROWS')):
+            rows = getattr(module, name, None)
+            if rows:
+                connection.execute(table.insert(), rows)
+        model._index_books(connection, getattr(module, 'BOOKS', ()))
+    search_cache.clear()
+    return url
+
+
+def _close_library(url):
+    # put back the journal and engine options a test may have changed
+    configure_journal()
+    configure(url)
+
+
+@pytest.fixture
+def library(request, tmp_path):
+    url = _open_library(tmp_path / 'library.db', request.module, getattr(request, 'param', {}))
+    yield Admin(id='desk')
+    _close_library(url)
+
+
+@pytest.fixture(scope='module')
+def shared_library(request, tmp_path_factory):
+    url = _open_library(tmp_path_factory.mktemp('library') / 'library.db', request.module,
+                        getattr(request, 'param', {}))
+    yield Admin(id='desk')
+    _close_library(url)
@@ -0,0 +1,265 @@
+"""A journal of circulation events written behind the desk operations.
+
+    journal = Journal(store, mode='batched')
+    events = journal.stage(connection, events)     # inside the operation's transaction
+    journal.emit(events)                            # after it commits: queues the events and returns
+    journal.flush()                                 # waits until everything emitted is stored or spilled
+    journal.replay()                                # stores the events spilled to the local file
+
+`store(events, connection=None)` writes a list of event dicts, through
+`connection` when given and otherwise in a transaction of its own, and raises
+when it can't.  The mode decides what an emit costs the caller and what an
+outage costs the journal:
+
+    off       events are discarded
+    sync      stage stores the events in the operation's transaction, and
+              emit stores any others before returning
+    batched   a writer thread stores them in batches of `batch_size`, or
+              every `flush_interval` seconds; a batch the store keeps refusing
+              after `retries` attempts is dropped and logged
+    spill     as batched, but a refused batch is appended to `spill_path` as
+              JSON lines and replayed once the store takes a batch again
+
+At most `max_pending` events wait for the writer.  When that many are queued
+emit blocks for up to `block_timeout` seconds, then spills the events itself
+in spill mode or drops them in batched mode.  Events carry an `event_id`, so
+the store can skip the ones a replay repeats.
+"""
+from datetime import date, datetime
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+__all__ = ['Journal', 'JOURNAL_MODES']
+
+JOURNAL_MODES = ('off', 'sync', 'batched', 'spill')
+
+journal_log = logging.getLogger('library.journal')
+
+# wakes the writer to store what it holds at once
+_FLUSH = object()
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'t': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 't' in value:
+            return date.fromisoformat(value['t'])
+    return value
+
+
+class Journal:
+    def __init__(self, store, mode='batched', batch_size=500, flush_interval=1.0, max_pending=10000,
+                 block_timeout=5.0, spill_path=None, retries=3, retry_delay=0.5):
+        if mode not in JOURNAL_MODES:
+            raise ValueError('unknown journal mode {!r}, expected one of {}'.format(mode, JOURNAL_MODES))
+        if mode == 'spill' and spill_path is None:
+            raise ValueError('the spill journal mode needs a spill_path')
+        self.store = store
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.replayed = 0
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._unreplayed = False
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+
+    def stage(self, connection, events):
+        """Return the events to emit once the caller's transaction commits.
+
+        In sync mode they are stored through `connection` instead, so they
+        commit or roll back with the operation, and none are returned.
+        """
+        if self.mode != 'sync' or not events:
+            return events
+        self.store(events, connection)
+        self._count('written', len(events))
+        return []
+
+    def emit(self, events):
+        if not events or self.mode == 'off':
+            return
+        if self.mode == 'sync':
+            self.store(events)
+            self._count('written', len(events))
+            return
+        self._start()
+        for i, event in enumerate(events):
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+            except queue.Full:
+                self._overflow(events[i:])
+                return
+
+    def flush(self):
+        if self._thread is None:
+            return
+        self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'mode': self.mode,
+                    'pending': self._queue.qsize(),
+                    'written': self.written,
+                    'batches': self.batches,
+                    'spilled': self.spilled,
+                    'dropped': self.dropped,
+                    'replayed': self.replayed}
+
+    def replay(self, path=None):
+        """Store the events spilled to `path` (spill_path by default) and remove it; return how many were stored.
+
+        The file is renamed before it is read, so a writer still spilling starts
+        a new one.  A replay that fails leaves the renamed file, which the next
+        replay picks up again.
+        """
+        path = path or self.spill_path
+        if path is None:
+            return 0
+        with self._replay_lock:
+            count = self._replay(path)
+        self._count('replayed', count)
+        return count
+
+    def _replay(self, path):
+        replaying = path + '.replaying'
+        with self._spill_lock:
+            if path == self.spill_path:
+                self._unreplayed = False
+            if os.path.exists(path):
+                if os.path.exists(replaying):
+                    # an earlier replay failed part way; add the newer spills to what it left
+                    with open(path) as source, open(replaying, 'a') as target:
+                        target.write(source.read())
+                    os.remove(path)
+                else:
+                    os.replace(path, replaying)
+        if not os.path.exists(replaying):
+            return 0
+        count = 0
+        with open(replaying) as lines:
+            batch = []
+            for line in lines:
+                if line.strip():
+                    batch.append({key: _load_value(value) for key, value in json.loads(line).items()})
+                if len(batch) >= self.batch_size:
+                    self.store(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.store(batch)
+                count += len(batch)
+        os.remove(replaying)
+        return count
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            batch = []
+            item = self._queue.get()
+            taken = 1
+            if item is not _FLUSH:
+                batch.append(item)
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    taken += 1
+                    if item is _FLUSH:
+                        break
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception:
+                journal_log.exception('journal writer lost %d events', len(batch))
+                self._count('dropped', len(batch))
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        for attempt in range(self.retries):
+            try:
+                self.store(batch)
+            except Exception:
+                if self.mode == 'spill':
+                    journal_log.warning('journal store failed, spilling %d events to %s', len(batch),
+                                        self.spill_path, exc_info=True)
+                    self._spill(batch)
+                    return
+                journal_log.warning('journal store failed (attempt %d of %d)', attempt + 1, self.retries,
+                                    exc_info=True)
+                time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            self._count('written', len(batch))
+            self._count('batches', 1)
+            if self._unreplayed:
+                # the store is back, so earlier spills can go in behind this batch
+                try:
+                    self.replay()
+                except Exception:
+                    journal_log.warning('journal replay failed', exc_info=True)
+            return
+        journal_log.error('journal dropped %d events after %d failed attempts', len(batch), self.retries)
+        self._count('dropped', len(batch))
+
+    def _overflow(self, events):
+        if self.mode == 'spill':
+            self._spill(events)
+            return
+        journal_log.error('journal queue full for %.1f seconds, dropped %d events', self.block_timeout, len(events))
+        self._count('dropped', len(events))
+
+    def _spill(self, events):
+        with self._spill_lock:
+            with open(self.spill_path, 'a') as spill:
+                for event in events:
+                    spill.write(json.dumps({key: _dump_value(value) for key, value in event.items()},
+                                           separators=(',', ':')) + '\n')
+                spill.flush()
+                os.fsync(spill.fileno())
+            self._unreplayed = True
+        self._count('spilled', len(events))
+
+    def _count(self, name, amount):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
@@ -7,12 +7,29 @@ from kivy.uix.togglebutton import ToggleButton
 from kivy.utils import get_color_from_hex as hex_color
 from kivy.uix.boxlayout import BoxLayout
 from kivy.factory import Factory
-from kivy.uix.gridlayout import GridLayout
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.properties import ListProperty
+from kivy.clock import Clock, mainthread
+from kivy.logger import Logger
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import os
 
 from model import *
+from report import export_report
+from replica import LocalReplica
 from datetime import date
 
+PAGE_SIZE = 200
+SEARCH_DEBOUNCE = 0.25
+STATS_INTERVAL = 1
+SEARCH_FACETS = ('type', 'publisher', 'year', 'price')
+FACET_LIMIT = 5
+# a local catalog copy lets a terminal keep searching while the database is unreachable
+LOCAL_REPLICA = os.environ.get('LIBRARY_LOCAL_REPLICA')
+PREFER_LOCAL_REPLICA = os.environ.get('LIBRARY_LOCAL_REPLICA_PREFER', '').lower() in ('1', 'true', 'yes')
+REPLICA_SYNC_INTERVAL = 30
+
 
 class RadioButton(ToggleButton):
     def _do_press(self):
@@ -35,58 +52,168 @@ class RadioButton(ToggleButton):
 #     #     if
 
 
-class BookTable(BoxLayout):
-    def refresh(self, books):
-        self.clear_widgets()
-        self.add_widget(Factory.TableHeader())
-        book_list = BookList()
-        self.add_widget(book_list)
-        self.book_list = book_list
+class ResultTable(BoxLayout):
+    def refresh(self, books, loader=None):
+        self.book_list.refresh(books, loader)
 
-        self.book_list.refresh(books)
+    def sort_by(self, attr):
+        self.book_list.sort_by(attr)
 
 
-class BookList(ScrollView):
-    def refresh(self, books):
-        self.clear_widgets()
-        data_grid = Factory.DataGrid()
-        self.add_widget(data_grid)
-        self.data_grid = data_grid
+class BookTable(ResultTable):
+    pass
 
-        self.data_grid.books = books
-        self.data_grid.refresh()
 
+class LoanTable(ResultTable):
+    pass
 
-class DataGrid(GridLayout):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.books = []
-        self.size_hint_y = None
-        self.cols = 9
 
-    def render_book(self, book):
-        attrs = ['id',
-                 'type',
-                 'title',
-                 'publisher',
-                 'year',
-                 'author',
-                 'price',
-                 'total',
-                 'stock'
-                 ]
+class BookRow(BoxLayout):
+    values = ListProperty()
 
-        for attr in attrs:
-            content = getattr(book, attr)
+    def on_values(self, instance, values):
+        if len(self.children) != len(values):
+            self.clear_widgets()
+            for _ in values:
+                self.add_widget(Factory.RobotoLabel())
+        for label, content in zip(reversed(self.children), values):
             if content is None:
-                self.add_widget(Factory.RobotoLabel(text='null', italic=True))
+                label.text = 'null'
+                label.italic = True
             else:
-                self.add_widget(Factory.RobotoLabel(text=str(content)))
+                label.text = str(content)
+                label.italic = False
+
+
+class BookList(RecycleView):
+    attrs = ['id',
+             'type',
+             'title',
+             'publisher',
+             'year',
+             'author',
+             'price',
+             'total',
+             'stock'
+             ]
 
-    def refresh(self):
-        for book in self.books:
-            self.render_book(book)
-        self.height = 50 * len(self.books)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.loader = None
+        self.books = []
+        self.sort_attr = None
+        self.descending = False
+
+    def render(self, books):
+        if isinstance(books, BookColumns):
+            return [{'values': list(values)} for values in zip(*(books.values(attr) for attr in self.attrs))]
+        return [{'values': [getattr(book, attr) for attr in self.attrs]} for book in books]
+
+    def refresh(self, books, loader=None):
+        # `loader` returns the next rows and the loader for the rows after them
+        worker.cancel('load_more')
+        self.loader = loader
+        self.books = books
+        self.sort_attr = None
+        self.data = self.render(books)
+        self.scroll_y = 1
+
+    def sort_by(self, attr):
+        # a header click re-orders the rows on screen; a partly loaded list can't be
+        if self.loader is not None:
+            return
+        if not isinstance(self.books, BookColumns):
+            self.books = BookColumns.from_rows(([getattr(book, name) for name in self.attrs] for book in self.books),
+                                               self.attrs)
+        self.descending = self.sort_attr == attr and not self.descending
+        self.sort_attr = attr
+        self.books = self.books.sort([(attr, self.descending), ('id', False)])
+        self.data = self.render(self.books)
+
+    def load_more(self):
+        loader, self.loader = self.loader, None
+        worker.submit('load_more', loader, self.extend, lambda exc: Logger.exception('Library: paging failed'))
+
+    def extend(self, result):
+        books, self.loader = result
+        self.books = list(itertools.chain(self.books, books))
+        self.data.extend(self.render(books))
+
+    def on_scroll_y(self, instance, value):
+        if self.loader is None:
+            return
+        remaining = value * (self.layout_manager.height - self.height)
+        if remaining < self.height:
+            self.load_more()
+
+
+class LoanList(BookList):
+    attrs = ['card_id',
+             'id',
+             'title',
+             'author',
+             'borrow_date',
+             'return_date',
+             'overdue'
+             ]
+
+
+def page_loader(params, cursor):
+    def load():
+        page = search_books(page_size=PAGE_SIZE, cursor=cursor, columnar=True, **params)
+        return page.rows, page_loader(params, page.cursor) if page.cursor else None
+
+    return load
+
+
+def loan_loader(params, cursor):
+    def load():
+        page = Admin.list_borrows(page_size=PAGE_SIZE, cursor=cursor, **params)
+        return page.rows, loan_loader(params, page.cursor) if page.cursor else None
+
+    return load
+
+
+class Worker:
+    """Run model calls on a thread pool and deliver their outcome on the Kivy thread.
+
+    Each task has a key; submitting a new task under a key makes the results of
+    earlier tasks with that key stale, and stale results are dropped.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='library-worker')
+        self.generations = {}
+        self.pending = {}
+
+    def submit(self, key, fn, on_success, on_error, *args, **kwargs):
+        self.cancel(key)
+        generation = self.generations[key]
+        future = self.executor.submit(fn, *args, **kwargs)
+        self.pending[key] = future
+        future.add_done_callback(
+            lambda future: Clock.schedule_once(lambda dt: self.deliver(key, generation, future, on_success, on_error)))
+        return future
+
+    def cancel(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+        future = self.pending.pop(key, None)
+        if future is not None:
+            # a query already running can't be interrupted, its result is just dropped
+            future.cancel()
+
+    def deliver(self, key, generation, future, on_success, on_error):
+        if self.generations.get(key) != generation or future.cancelled():
+            return
+        self.pending.pop(key, None)
+        exc = future.exception()
+        if exc is None:
+            on_success(future.result())
+        else:
+            on_error(exc)
+
+
+worker = Worker()
 
 
 class LibraryRoot(BoxLayout):
@@ -98,8 +225,90 @@ class LibraryRoot(BoxLayout):
                 params[x] = input.text
         return params
 
+    def show_error(self, page, exc):
+        page.error.text = str(exc)
+        page.error.color = hex_color('#FF0000')
+
+    def show_success(self, page, result=None):
+        page.error.text = 'successful'
+        page.error.color = hex_color('#00FF00')
+
+    def run_task(self, key, fn, *args, on_success=None, on_error=None, **kwargs):
+        page = self.current_page
+        on_success = on_success or self.show_success
+        on_error = on_error or self.show_error
+        page.busy = True
+
+        def succeed(result):
+            page.busy = False
+            on_success(page, result)
+
+        def fail(exc):
+            page.busy = False
+            on_error(page, exc)
+
+        return worker.submit(key, fn, succeed, fail, *args, **kwargs)
+
+    def schedule_search(self):
+        # restart the countdown on every keystroke so a burst of typing costs one search
+        self.search_trigger.cancel()
+        self.search_trigger()
+
     def do_search_books(self):
-        attrs = ['title',
+        try:
+            params = self.build_search_params()
+        except (KeyError, ValueError) as exc:
+            self.show_error(self.current_page, 'incomplete criteria: {}'.format(exc))
+            return
+        page = self.current_page
+        page.error.text = ''
+        worker.cancel('load_more')
+        if page.last_search is not None:
+            refined = refine_search(*page.last_search, params)
+            if refined is not None:
+                worker.cancel('search')
+                page.busy = False
+                page.last_search = params, refined
+                page.book_table.refresh(refined.rows)
+                self.show_facets(page, len(refined.rows), count_facets(refined.rows, SEARCH_FACETS, FACET_LIMIT))
+                return
+
+        def show(page, result):
+            page.last_search = params, result
+            page.book_table.refresh(result.rows, page_loader(params, result.cursor) if result.cursor else None)
+            self.show_facets(page, result.total, result.facets)
+
+        self.run_task('search', faceted_search, SEARCH_FACETS, FACET_LIMIT, page_size=PAGE_SIZE, columnar=True,
+                      on_success=show, **params)
+
+    def show_facets(self, page, total, facets):
+        def label(name, value):
+            if value is None:
+                return 'none'
+            if name in ('year', 'price'):
+                return '{}-{}'.format(*value) if value[1] < 10000 else '{}+'.format(value[0])
+            return value
+
+        page.facets.text = '{} books    '.format(total) + '    '.join(
+            '{}: {}'.format(name, ', '.join('{} ({})'.format(label(name, value), count) for value, count in values))
+            for name, values in facets.items() if values)
+
+    def sort_results(self, table, attr):
+        page = self.current_page
+        if getattr(page, 'book_table', None) is not table or not hasattr(page, 'order_by_input'):
+            table.sort_by(attr)
+            return
+        # go through the search so the order controls agree; a complete result is re-sorted in memory
+        descending = page.order_by_input.text == attr and not page.desc_input.active
+        page.order_by_input.text = attr
+        page.desc_input.active = descending
+        self.search_trigger.cancel()
+        self.do_search_books()
+
+    def build_search_params(self):
+        attrs = ['keywords',
+                 'text_mode',
+                 'title',
                  'type',
                  'publisher',
                  'author',
@@ -119,6 +328,10 @@ class LibraryRoot(BoxLayout):
             params['price'] = float(params['start_price']), float(params['end_price'])
             del params['start_price']
             del params['end_price']
+        if 'keywords' in params.keys():
+            params['text'] = params.pop('keywords')
+        else:
+            params.pop('text_mode', None)
         if 'order_by' in params.keys():
             if params['order_by'] == 'default':
                 del params['order_by']
@@ -126,9 +339,7 @@ class LibraryRoot(BoxLayout):
                 params['order_by'] = getattr(books.c, params['order_by'])
                 if self.current_page.desc_input.active:
                     params['order_by'] = desc(params['order_by'])
-
-        rp = search_books(**params)
-        self.current_page.book_table.refresh(rp.fetchall())
+        return params
 
     def do_add_book(self):
         attrs = ['id',
@@ -149,32 +360,65 @@ class LibraryRoot(BoxLayout):
         if 'total' in params.keys():
             params['year'] = int(params['total'])
 
-        try:
-            self.admin.add_book(**params)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
-        else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+        self.run_task('add_book', self.admin.add_book, **params)
 
     def do_import_books(self):
-        try:
-            self.admin.import_books(self.current_page.path_input.text)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
+        page = self.current_page
+
+        @mainthread
+        def show_progress(status):
+            page.progress.text = str(status)
+
+        def show(page, status):
+            show_progress(status)
+            if status.rejected:
+                page.error.text = 'rejected rows written to {}'.format(status.reject_path)
+                page.error.color = hex_color('#FF0000')
+            else:
+                self.show_success(page)
+
+        if page.sync_input.active:
+            self.run_task('import_books', self.admin.sync_books, page.path_input.text,
+                          retire_missing=page.retire_input.active,
+                          resume=page.resume_input.active,
+                          progress=show_progress,
+                          on_success=show)
         else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+            self.run_task('import_books', self.admin.import_books, page.path_input.text,
+                          resume=page.resume_input.active,
+                          progress=show_progress,
+                          on_success=show)
 
-    def do_list_borrows(self):
+    def do_export_report(self):
+        page = self.current_page
         try:
-            borrowed_books = self.admin.list_borrows(self.current_page.card_id_input.text)
-            self.current_page.book_table.refresh(borrowed_books)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
+            start = date.fromisoformat(page.start_input.text) if page.start_input.text else None
+            end = date.fromisoformat(page.end_input.text) if page.end_input.text else None
+        except ValueError as exc:
+            self.show_error(page, exc)
+            return
+
+        @mainthread
+        def show_progress(count):
+            page.progress.text = '{} rows written'.format(count)
+
+        def show(page, count):
+            show_progress(count)
+            self.show_success(page)
+
+        page.progress.text = ''
+        self.run_task('export_report', export_report, page.report_input.text, page.path_input.text,
+                      start=start, end=end, progress=show_progress, on_success=show)
+
+    def do_list_borrows(self):
+        # a desk can look up several cards at once, separated by commas
+        card_ids = [card_id.strip() for card_id in self.current_page.card_id_input.text.split(',') if card_id.strip()]
+        params = {'card_id': card_ids[0]} if len(card_ids) == 1 else {'card_ids': card_ids}
+
+        def show(page, result):
+            page.book_table.refresh(result.rows, loan_loader(params, result.cursor) if result.cursor else None)
+
+        self.run_task('list_borrows', self.admin.list_borrows, page_size=PAGE_SIZE, on_success=show, **params)
 
     def do_borrow_book(self):
         try:
@@ -183,33 +427,66 @@ class LibraryRoot(BoxLayout):
             for x in params.keys():
                 params[x] = int(params[x])
             return_date = date(**params)
-            self.admin.borrow_book(self.current_page.card_id_input.text,
-                                   self.current_page.book_id_input.text,
-                                   return_date)
-        except ForbiddenOperationError as exc:
-            error_text = str(exc)
-            error_text += '\nnearest return date: '
-            error_text += self.admin.find_nearest_return(
-                self.current_page.book_id_input.text).strftime('%Y/%m/%d')
-            self.current_page.error.text = error_text
-            self.current_page.error.color = hex_color('#FF0000')
         except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
-        else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+            self.show_error(self.current_page, exc)
+            return
+        admin = self.admin
+        card_id = self.current_page.card_id_input.text
+        book_id = self.current_page.book_id_input.text
+
+        def borrow():
+            try:
+                admin.borrow_book(card_id, book_id, return_date)
+            except ForbiddenOperationError as exc:
+                nearest = admin.find_nearest_return(book_id)
+                if nearest is None:
+                    raise
+                raise ForbiddenOperationError('{}\nnearest return date: {}'.format(
+                    exc, nearest.strftime('%Y/%m/%d'))) from exc
+
+        self.run_task('borrow_book', borrow)
 
     def do_return_book(self):
+        self.run_task('return_book', self.admin.return_book,
+                      self.current_page.card_id_input.text,
+                      self.current_page.book_id_input.text)
+
+    def do_queue_book(self):
+        page = self.current_page
+        if page.book_id_input.text:
+            page.queue.append(page.book_id_input.text)
+            page.book_id_input.text = ''
+
+    def do_clear_queue(self):
+        self.current_page.queue = []
+
+    def show_item_results(self, page, results):
+        failures = [result for result in results if not result.ok]
+        page.queue = [result.book_id for result in failures]
+        if failures:
+            page.error.text = '\n'.join('{}: {}'.format(result.book_id, result.error) for result in failures)
+            page.error.color = hex_color('#FF0000')
+        else:
+            page.error.text = '{} items successful'.format(len(results))
+            page.error.color = hex_color('#00FF00')
+
+    def do_borrow_queued(self):
         try:
-            self.admin.return_book(self.current_page.card_id_input.text,
-                                   self.current_page.book_id_input.text)
+            attrs = ['year', 'month', 'day']
+            params = self.build_params(attrs)
+            for x in params.keys():
+                params[x] = int(params[x])
+            return_date = date(**params)
         except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
-        else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+            self.show_error(self.current_page, exc)
+            return
+        self.run_task('borrow_book', self.admin.borrow_books, self.current_page.card_id_input.text,
+                      [(book_id, return_date) for book_id in self.current_page.queue],
+                      on_success=self.show_item_results)
+
+    def do_return_queued(self):
+        self.run_task('return_book', self.admin.return_books, self.current_page.card_id_input.text,
+                      list(self.current_page.queue), on_success=self.show_item_results)
 
     def do_add_card(self):
         attrs = ['id',
@@ -220,47 +497,76 @@ class LibraryRoot(BoxLayout):
 
         params = self.build_params(attrs)
 
-        try:
-            self.admin.add_card(**params)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
-        else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+        self.run_task('add_card', self.admin.add_card, **params)
 
     def do_remove_card(self):
-        try:
-            self.admin.remove_card(self.current_page.id_input.text)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-            self.current_page.error.color = hex_color('#FF0000')
-        else:
-            self.current_page.error.text = 'successful'
-            self.current_page.error.color = hex_color('#00FF00')
+        self.run_task('remove_card', self.admin.remove_card, self.current_page.id_input.text)
+
+    def refresh_stats(self):
+        snapshot = metrics.snapshot()
+        lines = ['{:<22}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+        sections = [('operations', snapshot['operations']), ('statements', snapshot['queries']),
+                    ('pool', {'checkout wait': snapshot['pool_wait'], 'connection held': snapshot['pool_hold']})]
+        for title, summaries in sections:
+            lines.append(title)
+            for name, summary in summaries.items():
+                if summary['count']:
+                    lines.append('  {:<20}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+                        name, summary['count'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+                        summary['max_ms']))
+        lines.append('slow queries (over {:.0f} ms): {}'.format(snapshot['slow_threshold_ms'] or 0,
+                                                                 snapshot['slow_count']))
+        for entry in reversed(snapshot['slow_queries'][-5:]):
+            lines.append('  {} {:.1f} ms {}: {}'.format(entry['at'], entry['ms'], entry['operation'],
+                                                      ' '.join(entry['statement'].split())[:120]))
+        self.current_page.table.text = '\n'.join(lines)
+
+    def do_dump_stats(self):
+        path = self.current_page.path_input.text
+
+        def dump():
+            with open(path, 'w') as file:
+                file.write(metrics.to_prometheus() if path.endswith('.prom') else metrics.to_json(indent=2))
+
+        self.run_task('dump_stats', dump)
+
+    def do_reset_stats(self):
+        metrics.reset()
+        self.refresh_stats()
 
     def do_login(self):
-        try:
-            self.admin = admin_login(self.current_page.id_input.text, self.current_page.password_input.text)
-        except Exception as exc:
-            self.current_page.error.text = str(exc)
-        else:
+        def logged_in(page, admin):
+            self.admin = admin
             self.load_ui('admin')
 
+        self.run_task('login', admin_login, self.current_page.id_input.text, self.current_page.password_input.text,
+                      on_success=logged_in,
+                      on_error=lambda page, exc: setattr(page.error, 'text', str(exc)))
+
     def do_logout(self):
         self.admin = None
         self.load_ui('user')
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.search_trigger = Clock.create_trigger(lambda dt: self.do_search_books(), SEARCH_DEBOUNCE)
+        self.stats_trigger = Clock.create_trigger(lambda dt: self.refresh_stats(), STATS_INTERVAL, interval=True)
         self.load_ui('user')
 
     def load_slide(self, cls_name):
-        page = getattr(Factory, cls_name)()
+        self.stats_trigger.cancel()
+        # a page is built the first time it is shown and kept until the menu changes
+        page = self.pages.get(cls_name)
+        if page is None:
+            page = self.pages[cls_name] = getattr(Factory, cls_name)()
         self.func_pages.load_slide(page)
         self.current_page = page
+        if cls_name == 'Stats':
+            self.refresh_stats()
+            self.stats_trigger()
 
     def load_ui(self, mode):
+        self.pages = {}
         if mode == 'user':
             self.clear_widgets()
             self.current_list = Factory.UserFunctionList()
@@ -285,12 +591,47 @@ class FuncPages(BoxLayout):
 
 class LibraryApp(App):
     def build(self):
-        prepare_db()
+        self.replica = None
+        if LOCAL_REPLICA:
+            self.replica = LocalReplica(LOCAL_REPLICA)
+            self.replica.attach(prefer=PREFER_LOCAL_REPLICA)
+        # the window comes up first; connecting and checking the schema happen on the worker
+        worker.submit('prepare_db', prepare_db, self.database_ready, self.database_failed)
         return LibraryRoot()
 
+    def database_ready(self, prepared):
+        Logger.info('Library: database {}'.format('prepared' if prepared else 'schema current'))
+        self.start_replica_sync()
+
+    def database_failed(self, exc):
+        if self.replica is None:
+            Logger.error('Library: database unavailable: {}'.format(exc))
+            self.root.show_error(self.root.current_page, 'database unavailable: {}'.format(exc))
+            return
+        Logger.warning('Library: database unreachable, searching the local catalog: {}'.format(exc))
+        self.start_replica_sync()
+
+    def start_replica_sync(self):
+        if self.replica is not None:
+            self.sync_replica()
+            Clock.schedule_interval(lambda dt: self.sync_replica(), REPLICA_SYNC_INTERVAL)
+
+    def sync_replica(self):
+        worker.submit('replica_sync', self.replica.sync,
+                      lambda count: Logger.info('Library: local catalog refreshed {} books'.format(count)),
+                      lambda exc: Logger.warning('Library: local catalog sync failed: {}'.format(exc)))
+
 
 if __name__ == '__main__':
     from kivy.core.window import Window
 
     Window.clearcolor = hex_color('#FFFFFF')
+    if os.environ.get('LIBRARY_EXIT_AFTER_FIRST_FRAME'):
+        # used by benchmark.py to time start-up
+        def first_frame(*args):
+            Window.unbind(on_flip=first_frame)
+            print('first frame', flush=True)
+            App.get_running_app().stop()
+
+        Window.bind(on_flip=first_frame)
     LibraryApp().run()
@@ -0,0 +1,65 @@
+"""Rebuild or check the tables derived from the catalog and the loans.
+
+    python maintenance.py verify-circulation
+    python maintenance.py rebuild-circulation [BOOK_ID ...]
+    python maintenance.py refresh-overdue
+    python maintenance.py rebuild-text-index
+    python maintenance.py heartbeat [--interval SECONDS]
+    python maintenance.py trim-change-log [--keep ENTRIES]
+    python maintenance.py replay-journal [--path SPILL_FILE]
+
+The database is taken from --url or LIBRARY_DB_URL, as for the application.
+"""
+import argparse
+import sys
+import time
+
+from model import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description='maintain the library database')
+    parser.add_argument('--url', help='database URL, defaults to LIBRARY_DB_URL')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('verify-circulation', help='list books whose circulation summary disagrees with borrows')
+    rebuild = commands.add_parser('rebuild-circulation', help='recompute the circulation summary from borrows')
+    rebuild.add_argument('book_ids', nargs='*', help='only these books')
+    commands.add_parser('refresh-overdue', help='bring the overdue counts up to today')
+    commands.add_parser('rebuild-text-index', help='re-tokenize every book for keyword search')
+    heartbeat = commands.add_parser('heartbeat', help='keep stamping the primary so replica lag can be measured')
+    heartbeat.add_argument('--interval', type=float, default=1)
+    trim = commands.add_parser('trim-change-log', help='drop old change feed entries')
+    trim.add_argument('--keep', type=int, default=100000)
+    replay = commands.add_parser('replay-journal', help='store the circulation events spilled while the database '
+                                                        'was unreachable')
+    replay.add_argument('--path', help='spill file, defaults to LIBRARY_JOURNAL_SPILL_PATH')
+    args = parser.parse_args()
+
+    configure(args.url)
+    prepare_db()
+    if args.command == 'verify-circulation':
+        drifted = verify_circulation()
+        for book_id in drifted:
+            print(book_id)
+        print('{} books out of step'.format(len(drifted)), file=sys.stderr)
+        return 1 if drifted else 0
+    elif args.command == 'rebuild-circulation':
+        rebuild_circulation(args.book_ids or None)
+    elif args.command == 'refresh-overdue':
+        refresh_overdue()
+    elif args.command == 'rebuild-text-index':
+        rebuild_text_index()
+    elif args.command == 'trim-change-log':
+        print('{} entries removed'.format(trim_change_log(args.keep)), file=sys.stderr)
+    elif args.command == 'replay-journal':
+        print('{} events stored'.format(journal.replay(args.path)), file=sys.stderr)
+    elif args.command == 'heartbeat':
+        while True:
+            write_heartbeat()
+            time.sleep(args.interval)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+from collections import deque, OrderedDict
+from functools import wraps
+from datetime import datetime
+import threading
+import logging
+import time
+import json
+
+from sqlalchemy import event
+
+__all__ = ['Histogram', 'Metrics']
+
+# bucket upper bounds in seconds, as in the Prometheus client defaults
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger('library.slow_query')
+
+
+class Histogram:
+    """Cumulative bucket counts for export plus a window of recent samples for percentiles."""
+
+    def __init__(self, window=1000):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.rows = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds, rows=None):
+        self.count += 1
+        self.sum += seconds
+        if rows is not None:
+            self.rows += rows
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return None
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def summary(self):
+        return {'count': self.count,
+                'rows': self.rows,
+                'mean_ms': self.sum / self.count * 1000 if self.count else None,
+                'p50_ms': _ms(self.percentile(0.5)),
+                'p95_ms': _ms(self.percentile(0.95)),
+                'p99_ms': _ms(self.percentile(0.99)),
+                'max_ms': _ms(max(self.recent) if self.recent else None)}
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def _statement_kind(statement):
+    words = statement.split(None, 1)
+    return words[0].lower() if words else ''
+
+
+class Metrics:
+    """Latency histograms per operation, per kind of statement and for pooled connections.
+
+    Operations are timed with the ``timed`` decorator and waits for a pooled
+    connection by ``timed_connect``; statements and the time connections spend
+    checked out of the pool are recorded by the engine listeners installed by
+    ``attach``.  Statements slower than ``slow_threshold`` seconds are logged
+    to the ``library.slow_query`` logger and kept in ``slow_queries`` along
+    with the operation that issued them.
+    """
+
+    def __init__(self, slow_threshold=0.2, slow_log_size=100):
+        self.slow_threshold = slow_threshold
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self.operations = OrderedDict()
+        self.queries = OrderedDict()
+        self.pool_wait = Histogram()
+        self.pool_hold = Histogram()
+        self.slow_count = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.queries.clear()
+            self.pool_wait = Histogram()
+            self.pool_hold = Histogram()
+            self.slow_queries.clear()
+            self.slow_count = 0
+
+    def observe(self, name, seconds, rows=None):
+        with self._lock:
+            histogram = self.operations.get(name)
+            if histogram is None:
+                histogram = self.operations[name] = Histogram()
+            histogram.observe(seconds, rows)
+
+    def timed(self, name):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                stack = self._local.__dict__.setdefault('operations', [])
+                stack.append(name)
+                start = time.perf_counter()
+                result = None
+                try:
+                    result = fn(*args, **kwargs)
+                    return result
+                finally:
+                    # failed calls count too, the desk waited for them all the same
+                    stack.pop()
+                    self.observe(name, time.perf_counter() - start,
+                                 len(result) if hasattr(result, '__len__') else None)
+
+            return wrapper
+
+        return decorator
+
+    def timed_connect(self, engine):
+        # the pool has no event for a checkout starting to wait, so the wait is timed around the call
+        start = time.perf_counter()
+        try:
+            return engine.connect()
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.pool_wait.observe(seconds)
+
+    def current_operation(self):
+        stack = getattr(self._local, 'operations', None)
+        return stack[-1] if stack else None
+
+    # engine listeners
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        # pool events given the engine follow it to the pool dispose() puts in place
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['metrics_checkout'] = time.perf_counter()
+
+    def _checkin(self, dbapi_connection, connection_record):
+        # long holds next to long waits point at the operations keeping the pool short
+        start = connection_record.info.pop('metrics_checkout', None)
+        if start is not None:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.pool_hold.observe(seconds)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get('metrics_query_start')
+            if starts:
+                starts.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        # drivers report -1 when the count isn't known before fetching, e.g. SQLite selects
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        kind = _statement_kind(statement)
+        with self._lock:
+            histogram = self.queries.get(kind)
+            if histogram is None:
+                histogram = self.queries[kind] = Histogram()
+            histogram.observe(seconds, rows)
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            entry = {'at': datetime.now().isoformat(timespec='seconds'),
+                     'operation': self.current_operation(),
+                     'ms': seconds * 1000,
+                     'rows': rows,
+                     'statement': statement,
+                     'parameters': repr(parameters)[:500]}
+            with self._lock:
+                self.slow_queries.append(entry)
+                self.slow_count += 1
+            slow_log.warning('%.1f ms in %s: %s', entry['ms'], entry['operation'], statement)
+
+    # export
+
+    def snapshot(self):
+        with self._lock:
+            return {'operations': OrderedDict((name, histogram.summary())
+                                              for name, histogram in self.operations.items()),
+                    'queries': OrderedDict((kind, histogram.summary()) for kind, histogram in self.queries.items()),
+                    'pool_wait': self.pool_wait.summary(),
+                    'pool_hold': self.pool_hold.summary(),
+                    'slow_threshold_ms': _ms(self.slow_threshold),
+                    'slow_count': self.slow_count,
+                    'slow_queries': list(self.slow_queries)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            _histogram_lines(lines, 'library_operation_seconds', 'operation', self.operations)
+            _histogram_lines(lines, 'library_query_seconds', 'statement', self.queries)
+            lines.append('# TYPE library_query_rows_total counter')
+            for kind, histogram in self.queries.items():
+                lines.append('library_query_rows_total{{statement="{}"}} {}'.format(kind, histogram.rows))
+            _histogram_lines(lines, 'library_pool_wait_seconds', None, {None: self.pool_wait})
+            _histogram_lines(lines, 'library_pool_hold_seconds', None, {None: self.pool_hold})
+            lines.append('# TYPE library_slow_queries_total counter')
+            lines.append('library_slow_queries_total {}'.format(self.slow_count))
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(lines, metric, label, histograms):
+    lines.append('# TYPE {} histogram'.format(metric))
+    for value, histogram in histograms.items():
+        labels = '{}="{}",'.format(label, value) if label else ''
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{}le="{}"}} {}'.format(metric, labels, bound, cumulative))
+        lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(metric, labels, histogram.count))
+        labels = '{{{}}}'.format(labels.rstrip(',')) if labels else ''
+        lines.append('{}_sum{} {}'.format(metric, labels, histogram.sum))
+        lines.append('{}_count{} {}'.format(metric, labels, histogram.count))
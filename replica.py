@@ -0,0 +1,145 @@
+"""A local SQLite copy of the catalog that terminals can search while the database is unreachable.
+
+    replica = LocalReplica('catalog.db')
+    replica.sync()              # everything the first time, then only the books changed since
+    replica.attach()            # search_books falls back to the copy, or uses it first with prefer=True
+
+The copy holds books and their keyword index.  It follows the primary through
+change_log: each sync fetches the current rows of the books logged since the
+version it last applied.  A version missing from the log may belong to a
+transaction that has not committed yet, so it is looked for again on later
+syncs until `gap_timeout` seconds have passed.
+"""
+import threading
+import json
+import time
+
+from sqlalchemy import MetaData, Table, Column, String, Text, create_engine, select, func
+
+import model
+from model import books, book_terms, indexed_terms, change_log, router
+
+__all__ = ['LocalReplica']
+
+replica_state = Table('replica_state', MetaData(),
+                      Column('key', String(50), primary_key=True),
+                      Column('value', Text(), nullable=False))
+
+# how far back a full pull looks for versions that may still commit
+GAP_WINDOW = 1000
+
+
+class LocalReplica:
+    def __init__(self, path, batch_size=1000, gap_timeout=60):
+        self.path = path
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.engine = create_engine('sqlite:///{}'.format(path),
+                                    connect_args={'check_same_thread': False, 'timeout': 30})
+        vocabulary = self.engine.has_table(indexed_terms.name)
+        model.Base.metadata.create_all(self.engine, tables=[books, book_terms, indexed_terms])
+        if not vocabulary:
+            with self.engine.begin() as local:
+                model._fill_vocabulary(local)
+        replica_state.create(self.engine, checkfirst=True)
+        self._lock = threading.Lock()
+
+    def attach(self, prefer=False):
+        router.local = self.engine
+        router.prefer_local = prefer
+
+    def detach(self):
+        if router.local is self.engine:
+            router.local = None
+            router.prefer_local = False
+
+    @property
+    def version(self):
+        with self.engine.connect() as connection:
+            return self._get(connection, 'version')
+
+    def _get(self, connection, key, default=None):
+        value = connection.execute(select([replica_state.c.value]).where(replica_state.c.key == key)).scalar()
+        return default if value is None else json.loads(value)
+
+    def _set(self, connection, key, value):
+        value = json.dumps(value)
+        if connection.execute(replica_state.update().where(replica_state.c.key == key)
+                              .values(value=value)).rowcount == 0:
+            connection.execute(replica_state.insert().values(key=key, value=value))
+
+    def sync(self):
+        """Bring the copy up to date with the primary; return the number of books fetched."""
+        with self._lock:
+            with self.engine.connect() as connection:
+                version = self._get(connection, 'version')
+                gaps = self._get(connection, 'gaps', {})
+            with model.engine.connect() as connection:
+                oldest, newest = connection.execute(select([func.min(change_log.c.version),
+                                                            func.max(change_log.c.version)])).first()
+            newest = newest or 0
+            if version is None or (oldest is not None and oldest > version + 1):
+                # first sync, or the entries this copy needs have been trimmed
+                return self._full_pull(newest)
+            return self._apply_changes(version, newest, gaps)
+
+    def _full_pull(self, newest):
+        count = 0
+        with self.engine.begin() as local:
+            local.execute(book_terms.delete())
+            local.execute(indexed_terms.delete())
+            local.execute(books.delete())
+            for chunk in model._stream_rows(select([books]), self.batch_size):
+                rows = [dict(row) for row in chunk]
+                local.execute(books.insert(), rows)
+                model._index_books(local, rows)
+                count += len(rows)
+            now = time.time()
+            self._set(local, 'version', newest)
+            self._set(local, 'gaps', {str(gap): now for gap in self._missing(max(newest - GAP_WINDOW, 0), newest)})
+        return count
+
+    def _missing(self, low, high):
+        with model.engine.connect() as connection:
+            present = {row.version for row in connection.execute(
+                select([change_log.c.version]).where((change_log.c.version > low) & (change_log.c.version <= high)))}
+        return set(range(low + 1, high + 1)) - present
+
+    def _apply_changes(self, version, newest, gaps):
+        changed = set()
+        present = set()
+        with model.engine.connect() as connection:
+            for chunk in model._stream_rows(select([change_log])
+                                            .where((change_log.c.version > version)
+                                                   & (change_log.c.version <= newest))
+                                            .order_by(change_log.c.version), self.batch_size):
+                present.update(entry.version for entry in chunk)
+                changed.update(entry.row_id for entry in chunk if entry.table_name == 'books')
+            if gaps:
+                for entry in connection.execute(select([change_log])
+                                                .where(change_log.c.version.in_([int(gap) for gap in gaps]))):
+                    del gaps[str(entry.version)]
+                    if entry.table_name == 'books':
+                        changed.add(entry.row_id)
+        now = time.time()
+        gaps = {gap: seen for gap, seen in gaps.items() if now - seen < self.gap_timeout}
+        gaps.update((str(gap), now) for gap in set(range(version + 1, newest + 1)) - present)
+
+        changed = sorted(changed)
+        for start in range(0, len(changed), self.batch_size):
+            self._refresh(changed[start:start + self.batch_size])
+        with self.engine.begin() as local:
+            self._set(local, 'version', newest)
+            self._set(local, 'gaps', gaps)
+        return len(changed)
+
+    def _refresh(self, book_ids):
+        # a logged book missing from the primary has been deleted there
+        with model.engine.connect() as connection:
+            rows = [dict(row) for row in connection.execute(select([books]).where(books.c.id.in_(book_ids)))]
+        with self.engine.begin() as local:
+            local.execute(book_terms.delete().where(book_terms.c.book_id.in_(book_ids)))
+            local.execute(books.delete().where(books.c.id.in_(book_ids)))
+            if rows:
+                local.execute(books.insert(), rows)
+                model._index_books(local, rows)
@@ -0,0 +1,190 @@
+"""Set-based circulation reports streamed to CSV or JSON.
+
+Every report is one aggregate or join query, read through a server-side
+cursor on a read replica when there is one, and written out chunk by chunk,
+so memory use does not grow with the size of the report.  The overdue report
+reads borrows, the loans still out.  The circulation and popular reports
+read every loan on record: the journal's borrow events in
+circulation_events, and the loans in borrows it has no event for yet.
+`start` and `end` bound the borrow date, inclusively; `as_of` is the day
+loans are judged overdue against.
+"""
+from datetime import date
+from decimal import Decimal
+import json
+import csv
+
+from sqlalchemy import select, func, case, distinct, and_, exists, null, union_all, type_coerce, Date
+
+import model
+from model import books, cards, borrows, circulation_events
+
+__all__ = ['REPORTS', 'FORMATS', 'report_query', 'export_report']
+
+
+def _borrowed_between(stmt, start, end, table=borrows):
+    if start is not None:
+        stmt = stmt.where(table.c.borrow_date >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.borrow_date <= end)
+    return stmt
+
+
+def _same_loan(table, other):
+    # events carry no loan id, but a return or removal repeats the card, book and dates of its checkout
+    return and_(table.c.card_id == other.c.card_id, table.c.book_id == other.c.book_id,
+                table.c.borrow_date == other.c.borrow_date, table.c.return_date == other.c.return_date)
+
+
+def _loans(start=None, end=None):
+    """Every loan on record, with `returned`, the day it was closed, or None while it is out.
+
+    Loans in borrows without a borrow event predate the journal, or were made
+    with it off, or are still waiting for its writer.
+    """
+    events = circulation_events
+    closes = events.alias('closes')
+    returned = select([type_coerce(func.min(func.date(closes.c.happened)), Date())]) \
+        .where(closes.c.kind != 'borrow').where(_same_loan(closes, events)).as_scalar()
+    journaled = select([events.c.card_id, events.c.book_id, events.c.borrow_date, events.c.return_date,
+                        returned.label('returned')]) \
+        .where(events.c.kind == 'borrow')
+    outstanding = select([borrows.c.card_id, borrows.c.book_id, borrows.c.borrow_date, borrows.c.return_date,
+                          type_coerce(null(), Date()).label('returned')]) \
+        .where(~exists().where(events.c.kind == 'borrow').where(_same_loan(events, borrows)))
+    return union_all(_borrowed_between(journaled, start, end, events),
+                     _borrowed_between(outstanding, start, end)).alias('loans')
+
+
+def overdue_loans(start=None, end=None, as_of=None):
+    """Outstanding loans past their return date, oldest first."""
+    as_of = as_of or date.today()
+    stmt = select([borrows.c.return_date,
+                   borrows.c.borrow_date,
+                   borrows.c.card_id,
+                   cards.c.name,
+                   cards.c.type.label('card_type'),
+                   cards.c.dept,
+                   borrows.c.book_id,
+                   books.c.title,
+                   borrows.c.admin_id]) \
+        .select_from(borrows.join(cards).join(books)) \
+        .where(borrows.c.return_date < as_of) \
+        .order_by(borrows.c.return_date, borrows.c.id)
+    return _borrowed_between(stmt, start, end)
+
+
+def loans_by_card(start=None, end=None, as_of=None):
+    """Loans, readers, titles and overdue loans per card type and department.
+
+    A loan counts as overdue when it was returned after its return date, or
+    is still out past it on `as_of`.  Loans of removed cards are left out, as
+    those cards have no type or department any more.
+    """
+    as_of = as_of or date.today()
+    loans = _loans(start, end)
+    closed = func.coalesce(loans.c.returned, as_of)
+    return select([cards.c.type.label('card_type'),
+                   cards.c.dept,
+                   func.count().label('loans'),
+                   func.count(distinct(loans.c.card_id)).label('cards'),
+                   func.count(distinct(loans.c.book_id)).label('titles'),
+                   func.sum(case([(closed > loans.c.return_date, 1)], else_=0)).label('overdue')]) \
+        .select_from(loans.join(cards, cards.c.id == loans.c.card_id)) \
+        .group_by(cards.c.type, cards.c.dept) \
+        .order_by(cards.c.type, cards.c.dept)
+
+
+def popular_titles(start=None, end=None, as_of=None, limit=100):
+    """The most borrowed titles, counting returned loans as well as those still out."""
+    loans = _loans(start, end)
+    loans = select([loans.c.book_id, func.count().label('loans')]).group_by(loans.c.book_id).alias('counts')
+    return select([books.c.id,
+                   books.c.title,
+                   books.c.author,
+                   books.c.publisher,
+                   loans.c.loans,
+                   books.c.total]) \
+        .select_from(loans.join(books, books.c.id == loans.c.book_id)) \
+        .order_by(loans.c.loans.desc(), books.c.id) \
+        .limit(limit)
+
+
+REPORTS = {
+    'overdue': overdue_loans,
+    'circulation': loans_by_card,
+    'popular': popular_titles,
+}
+
+
+def report_query(name, start=None, end=None, as_of=None):
+    if name not in REPORTS:
+        raise ValueError('unknown report {!r}, expected one of {}'.format(name, ', '.join(sorted(REPORTS))))
+    if start is not None and end is not None and start > end:
+        raise ValueError('report starts after it ends')
+    return REPORTS[name](start=start, end=end, as_of=as_of)
+
+
+def _plain(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class CSVReportWriter:
+    def __init__(self, file, columns):
+        self.writer = csv.writer(file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows([_plain(value) for value in row] for row in rows)
+
+    def close(self):
+        pass
+
+
+class JSONReportWriter:
+    """Writes a JSON array of objects one row at a time."""
+
+    def __init__(self, file, columns):
+        self.file = file
+        self.columns = columns
+        self.first = True
+        file.write('[')
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write('\n' if self.first else ',\n')
+            self.first = False
+            json.dump({column: _plain(value) for column, value in zip(self.columns, row)}, self.file)
+
+    def close(self):
+        self.file.write('\n]\n')
+
+
+FORMATS = {'csv': CSVReportWriter, 'json': JSONReportWriter}
+
+
+@model.metrics.timed('export_report')
+def export_report(name, path, format=None, start=None, end=None, as_of=None, chunk_size=1000, progress=None):
+    """Write report `name` to `path` and return the number of rows written.
+
+    The format defaults to the file extension.  `progress` is called with the
+    running row count after each chunk.
+    """
+    format = format or path.rsplit('.', 1)[-1].lower()
+    if format not in FORMATS:
+        raise ValueError('unknown report format {!r}, expected csv or json'.format(format))
+    stmt = report_query(name, start, end, as_of)
+    count = 0
+    with open(path, 'w', newline='') as file:
+        writer = FORMATS[format](file, [column.name for column in stmt.columns])
+        for chunk in model._stream_rows(stmt, chunk_size, readonly=True):
+            writer.write(chunk)
+            count += len(chunk)
+            if progress is not None:
+                progress(count)
+        writer.close()
+    return count
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import pytest
+
+from model import *
+
+TODAY = date.today()
+CARDS = [{'id': 'c1', 'name': 'ann', 'dept': 'cs', 'type': 'student'},
+         {'id': 'c2', 'name': 'bob', 'dept': 'cs', 'type': 'student'},
+         {'id': 'c3', 'name': 'cat', 'dept': 'math', 'type': 'teacher'},
+         {'id': 'c4', 'name': 'dan', 'dept': 'cs', 'type': 'student'}]
+BOOKS = [{'id': 'b{}'.format(i), 'type': 'novel', 'title': 'book {}'.format(i), 'publisher': 'ace', 'year': 2000 + i,
+          'author': 'someone', 'price': 10, 'total': 5, 'stock': 4} for i in range(8)]
+# c1 has six loans, two of them overdue; c2 and c3 one each; c4 none
+BORROWS = [{'card_id': 'c1', 'book_id': 'b{}'.format(i), 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=30),
+            'return_date': TODAY + timedelta(days=i - 2)} for i in range(6)] + [
+    {'card_id': 'c2', 'book_id': 'b6', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=3),
+     'return_date': TODAY + timedelta(days=10)},
+    {'card_id': 'c3', 'book_id': 'b7', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=3),
+     'return_date': TODAY + timedelta(days=1)}]
+
+
+def test_one_card_with_loan_details(library):
+    page = Admin.list_borrows('c1')
+    assert page.cursor is None
+    assert [row.id for row in page] == ['b0', 'b1', 'b2', 'b3', 'b4', 'b5']
+    assert [row.overdue for row in page] == [True, True, False, False, False, False]
+    first = page.rows[0]
+    assert first.card_id == 'c1' and first.title == 'book 0' and first.admin_id == 'desk'
+    assert first.borrow_date == TODAY - timedelta(days=30) and first.return_date == TODAY - timedelta(days=2)
+    # overdue is relative to the date asked about
+    assert not any(row.overdue for row in Admin.list_borrows('c1', as_of=TODAY - timedelta(days=5)))
+
+    assert len(Admin.list_borrows('c4')) == 0
+    with pytest.raises(NotFoundError):
+        Admin.list_borrows('nobody')
+    with pytest.raises(ValueError):
+        Admin.list_borrows()
+
+
+def test_pages_follow_the_cursor(library):
+    seen = []
+    cursor = None
+    while True:
+        page = Admin.list_borrows(card_ids=['c1', 'c2', 'c3'], page_size=3, cursor=cursor)
+        assert len(page) <= 3
+        seen.extend((row.card_id, row.id) for row in page)
+        cursor = page.cursor
+        if cursor is None:
+            break
+    assert seen == [(row.card_id, row.id) for row in Admin.list_borrows(card_ids=['c1', 'c2', 'c3'])]
+    assert len(seen) == 8
+    first = Admin.list_borrows('c1', page_size=5)
+    assert [row.id for row in Admin.list_borrows('c1', page_size=5, cursor=first.cursor)] == ['b5']
+    assert Admin.list_borrows('c1', page_size=6).cursor is None
+    with pytest.raises(ValueError):
+        Admin.list_borrows('c1', cursor='garbage')
+
+
+def test_several_cards_and_departments(library):
+    assert [row.card_id for row in Admin.list_borrows(card_ids=['c2', 'c3', 'nobody'])] == ['c2', 'c3']
+    assert {row.card_id for row in Admin.list_borrows(dept='cs')} == {'c1', 'c2'}
+    assert [row.id for row in Admin.list_borrows(card_ids=['c1', 'c3'], dept='math')] == ['b7']
+    assert len(Admin.list_borrows(dept='history')) == 0
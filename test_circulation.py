@@ -0,0 +1,127 @@
+from datetime import date, timedelta
+from threading import Barrier, Lock, Thread
+
+import pytest
+from sqlalchemy import select
+
+import model
+from model import *
+
+
+CARDS = [{'id': str(i), 'name': 'reader', 'type': 'student'} for i in range(50)]
+BOOKS = [{'id': 'hot', 'title': 'hot', 'price': 1, 'total': 5, 'stock': 5}]
+
+
+def stock(book_id):
+    with model.engine.connect() as connection:
+        return connection.execute(select([books.c.stock]).where(books.c.id == book_id)).scalar()
+
+
+def on_loan(book_id):
+    with model.engine.connect() as connection:
+        return len(connection.execute(select([borrows.c.id]).where(borrows.c.book_id == book_id)).fetchall())
+
+
+def test_concurrent_checkouts_never_oversell(library):
+    threads = 50
+    barrier = Barrier(threads)
+    lock = Lock()
+    outcomes = []
+
+    def checkout(card_id):
+        barrier.wait()
+        try:
+            library.borrow_book(card_id, 'hot', date.today() + timedelta(days=14))
+        except ForbiddenOperationError:
+            outcome = False
+        else:
+            outcome = True
+        with lock:
+            outcomes.append(outcome)
+
+    workers = [Thread(target=checkout, args=(str(i),)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert outcomes.count(True) == 5
+    assert stock('hot') == 0
+    assert on_loan('hot') == 5
+    assert availability('hot').on_loan == 5
+    assert verify_circulation() == []
+
+
+def test_borrow_and_return(library):
+    library.borrow_book('1', 'hot', date.today() + timedelta(days=14))
+    assert stock('hot') == 4
+    library.return_book('1', 'hot')
+    assert stock('hot') == 5
+    with pytest.raises(NotFoundError):
+        library.return_book('1', 'hot')
+    with pytest.raises(NotFoundError):
+        library.borrow_book('1', 'missing', date.today() + timedelta(days=14))
+    with pytest.raises(NotFoundError):
+        library.borrow_book('nobody', 'hot', date.today() + timedelta(days=14))
+    assert stock('hot') == 5
+
+
+def test_batch_checkout_and_return(library):
+    with model.engine.begin() as connection:
+        connection.execute(books.insert().values(id='cold', title='cold', price=1, total=1, stock=1))
+    due = date.today() + timedelta(days=14)
+    results = library.borrow_books('1', [('hot', due), ('cold', due), ('cold', due), ('missing', due)])
+    assert [result.ok for result in results] == [True, True, False, False]
+    assert isinstance(results[2].error, ForbiddenOperationError)
+    assert isinstance(results[3].error, NotFoundError)
+    assert (stock('hot'), stock('cold')) == (4, 0)
+
+    with pytest.raises(ForbiddenOperationError):
+        library.borrow_books('2', [('hot', due), ('cold', due)], atomic=True)
+    assert stock('hot') == 4
+
+    results = Admin.return_books('1', ['hot', 'cold', 'cold'])
+    assert [result.ok for result in results] == [True, True, False]
+    assert (stock('hot'), stock('cold')) == (5, 1)
+    with pytest.raises(NotFoundError):
+        Admin.return_books('nobody', ['hot'])
+
+
+def test_circulation_summary_follows_loans(library):
+    soon, later = date.today() + timedelta(days=7), date.today() + timedelta(days=14)
+    library.borrow_book('1', 'hot', later)
+    library.borrow_book('2', 'hot', soon)
+    assert (availability('hot').on_loan, Admin.find_nearest_return('hot')) == (2, soon)
+    library.return_book('2', 'hot')
+    assert (availability('hot').on_loan, Admin.find_nearest_return('hot')) == (1, later)
+
+    library.borrow_books('3', [('hot', soon), ('hot', later)])
+    Admin.return_books('3', ['hot'])
+    assert (availability('hot').on_loan, Admin.find_nearest_return('hot')) == (2, later)
+
+    Admin.remove_card('1')
+    Admin.remove_card('3')
+    status = availability('hot')
+    assert (status.stock, status.on_loan, status.earliest_return) == (5, 0, None)
+    with pytest.raises(NotFoundError):
+        Admin.remove_card('1')
+    assert verify_circulation() == []
+
+
+def test_overdue_counts_and_rebuild(library):
+    library.borrow_book('1', 'hot', date.today() + timedelta(days=14))
+    with model.engine.begin() as connection:
+        connection.execute(borrows.insert().values(card_id='2', book_id='hot', admin_id='desk',
+                                                   borrow_date=date.today() - timedelta(days=30),
+                                                   return_date=date.today() - timedelta(days=2)))
+        connection.execute(books.update().values(stock=books.c.stock - 1))
+    assert verify_circulation() == ['hot']
+    rebuild_circulation()
+    assert verify_circulation() == []
+    assert (availability('hot').on_loan, availability('hot').overdue) == (2, 1)
+
+    library.return_book('2', 'hot')
+    assert availability('hot').overdue == 0
+    refresh_overdue(date.today() + timedelta(days=30))
+    assert availability('hot').overdue == 1
+    assert verify_circulation() == []
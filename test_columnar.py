@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func
+
+import columnar
+from model import *
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(columnar, 'numpy', None)
+    return request.param
+
+
+pytestmark = pytest.mark.usefixtures('backend')
+
+BOOKS = [{'id': 'b1', 'type': 'novel', 'title': 'dune', 'publisher': 'ace', 'year': 1965, 'author': 'herbert',
+          'price': 9.5, 'total': 3, 'stock': 1},
+         {'id': 'b2', 'type': 'textbook', 'title': 'algorithms', 'publisher': 'mit', 'year': 2009, 'author': 'cormen',
+          'price': 80, 'total': 2, 'stock': 2},
+         {'id': 'b3', 'type': 'Novel', 'title': 'emma', 'publisher': None, 'year': None, 'author': 'austen',
+          'price': 4.25, 'total': 1, 'stock': 0},
+         {'id': 'b4', 'type': 'textbook', 'title': 'compilers', 'publisher': 'pearson', 'year': 1986, 'author': 'aho',
+          'price': 80, 'total': 4, 'stock': 4}]
+
+
+def ids(rows):
+    return [row.id for row in rows]
+
+
+def test_columns_hold_the_same_rows(library):
+    rows = search_books(order_by=books.c.id).rows
+    columns = search_books(order_by=books.c.id, columnar=True).rows
+    assert isinstance(columns, BookColumns)
+    assert len(columns) == 4
+    assert [tuple(row) for row in columns] == [tuple(row) for row in rows]
+    assert columns[2].publisher is None and columns[2].year is None
+    assert columns[-1].price == Decimal('80.00')
+    assert ids(columns[1:3]) == ['b2', 'b3']
+
+
+def test_sort_filter_and_count(library):
+    columns = search_books(columnar=True).rows
+    # nulls first, strings case-insensitively, ties by id
+    assert ids(columns.sort([('year', False), ('id', False)])) == ['b3', 'b1', 'b4', 'b2']
+    assert ids(columns.sort([('price', True), ('id', False)])) == ['b2', 'b4', 'b1', 'b3']
+    assert ids(columns.sort([('title', False)])) == ['b2', 'b4', 'b1', 'b3']
+    assert ids(columns.sort([('publisher', True), ('id', False)])) == ['b4', 'b2', 'b1', 'b3']
+
+    assert ids(columns.filter(type='novel')) == ['b1', 'b3']
+    assert ids(columns.filter(type='textbook', year=(1980, 2000))) == ['b4']
+    assert ids(columns.filter(price=(4.25, 9.5))) == ['b1', 'b3']
+    assert ids(columns.filter(price=80).filter(stock=(3, 10))) == ['b4']
+    assert len(columns.filter(year=(1900, 1900))) == 0
+
+    assert columns.group_count('type') == {'novel': 1, 'Novel': 1, 'textbook': 2}
+    assert columns.group_count('year') == {1965: 1, 2009: 1, None: 1, 1986: 1}
+    assert columns.filter(type='textbook').group_count('price') == {Decimal('80.00'): 2}
+
+
+def test_refine_search_reorders_columnar_pages(library):
+    previous = {'order_by': books.c.title}
+    page = search_books(columnar=True, **previous)
+    assert ids(page) == ['b2', 'b4', 'b1', 'b3']
+
+    current = {'order_by': desc(books.c.year)}
+    refined = refine_search(previous, page, current)
+    assert ids(refined) == ids(search_books(use_cache=False, **current)) == ['b2', 'b4', 'b1', 'b3']
+
+    current = {'order_by': books.c.price, 'type': 'textbook'}
+    assert ids(refine_search(previous, page, current)) == ['b2', 'b4']
+    # row pages and orders the database has to compute still go back to it
+    assert refine_search(previous, search_books(**previous), current) is None
+    assert refine_search(previous, page, {'order_by': func.lower(books.c.title)}) is None
@@ -0,0 +1,73 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+import model
+from model import *
+
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+BOOKS = [{'id': 'b{:02d}'.format(i), 'type': ['novel', 'textbook', 'journal'][i % 3],
+          'title': 'data systems {}'.format(i) if i % 2 else 'history {}'.format(i),
+          'publisher': None if i % 5 == 0 else ['ace', 'mit'][i % 2], 'author': 'author {}'.format(i % 4),
+          'year': None if i == 7 else 1960 + i, 'price': [5, 15, 30, 75, 150][i % 5], 'total': 1, 'stock': 1}
+         for i in range(30)]
+
+
+@pytest.mark.parametrize('params', [{}, {'type': 'novel'}, {'year': (1970, 1985), 'price': (0, 40)},
+                                    {'text': 'data', 'publisher': 'mit'}])
+def test_counts_agree_with_and_without_the_rows(library, params):
+    complete = faceted_search(**params)
+    paged = faceted_search(page_size=2, **params)
+    assert paged.cursor is not None or complete.total <= 2
+    assert len(paged.rows) <= 2
+    assert paged.total == complete.total == len(complete.rows)
+    assert paged.facets == complete.facets
+    assert sum(count for value, count in complete.facets['type']) == complete.total
+
+
+def test_facet_values_are_search_ranges(library):
+    page = faceted_search(page_size=5, columnar=True, facet_limit=3)
+    assert page.total == 30
+    assert page.facets['type'] == [('journal', 10), ('novel', 10), ('textbook', 10)]
+    assert page.facets['publisher'] == [('ace', 12), ('mit', 12), (None, 6)]
+    assert len(page.facets['author']) == 3
+    assert page.facets['year'] == [((1960, 1969), 9), ((1970, 1979), 10), ((1980, 1989), 10)]
+    assert page.facets['price'][0] == ((Decimal('0'), Decimal('9.99')), 6)
+
+    low, high = page.facets['year'][0][0]
+    assert faceted_search(year=(low, high)).total == 9
+    band, count = page.facets['price'][-1]
+    assert len(search_books(price=band)) == count
+
+
+def test_bad_facets(library):
+    with pytest.raises(ValueError):
+        faceted_search(facets=['colour'])
+    with pytest.raises(ValueError):
+        faceted_search(stream=True)
+
+
+def test_catalog_counts_are_kept_until_the_catalog_changes(library):
+    recounts = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if 'UNION ALL' in statement:
+            recounts.append(statement)
+
+    event.listen(model.engine, 'before_cursor_execute', count)
+    try:
+        first = faceted_search(page_size=5)
+        assert faceted_search(page_size=5).facets == first.facets and len(recounts) == 1
+        # a checkout changes no facet, a new book does
+        library.borrow_book('1', 'b00', date.today() + timedelta(days=14))
+        assert faceted_search(page_size=5, cursor=first.cursor).total == 30 and len(recounts) == 1
+        Admin.add_book(id='b30', type='novel', title='history 30', price=5, total=1, stock=1)
+        assert faceted_search(page_size=5).total == 31 and len(recounts) == 2
+        # criteria are always counted
+        faceted_search(page_size=5, type='novel')
+        faceted_search(page_size=5, type='novel')
+        assert len(recounts) == 4
+    finally:
+        event.remove(model.engine, 'before_cursor_execute', count)
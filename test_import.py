@@ -0,0 +1,90 @@
+import csv
+
+import pytest
+from sqlalchemy import func, select, text
+
+import model
+from model import *
+
+
+class Interrupted(Exception):
+    pass
+
+
+def write_feed(path, lines):
+    with open(str(path), 'w') as feed:
+        feed.write(''.join(line + '\n' for line in lines))
+    return str(path)
+
+
+def book_line(i, title=None):
+    return '(b{:03d}, novel, {}, ace, 1999, someone, 9.50, 2)'.format(i, title or 'book {}'.format(i))
+
+
+def stored_ids():
+    with model.engine.connect() as connection:
+        return [row.id for row in connection.execute(select([books.c.id]).order_by(books.c.id))]
+
+
+def rejects(path):
+    with open(path, newline='') as file:
+        return [(int(row[0]), row[1], row[2]) for row in csv.reader(file)]
+
+
+def test_bad_rows_go_to_the_rejects_file(library, tmp_path):
+    feed = write_feed(tmp_path / 'books.csv', [
+        book_line(0),
+        '(b001, novel, short row)',
+        '(b002, novel, , ace, 1999, someone, 9.50, 2)',
+        '(b003, novel, cheap, ace, 1999, someone, -1, 2)',
+        '(b004, novel, odd, ace, nineteen, someone, 9.50, 2)',
+        book_line(0, 'again'),
+        book_line(5)])
+    status = library.import_books(feed, batch_size=3)
+    assert (status.imported, status.rejected, status.line) == (2, 5, 7)
+    assert stored_ids() == ['b000', 'b005']
+    reasons = rejects(status.reject_path)
+    assert [(line, book_id) for line, reason, book_id in reasons] == [(2, 'b001'), (3, 'b002'), (4, 'b003'),
+                                                                        (5, 'b004'), (6, 'b000')]
+    assert 'title is required' in reasons[1][1] and "duplicate id 'b000'" in reasons[4][1]
+    # imported books are searchable by keyword
+    assert [row.id for row in search_books(text='book 5', use_cache=False)] == ['b005']
+
+
+def test_resume_after_an_interruption(library, tmp_path):
+    feed = write_feed(tmp_path / 'books.csv', [book_line(i) for i in range(10)] + ['(b999, broken)'])
+    batches = []
+
+    def stop_after_two(status):
+        batches.append(status.line)
+        if len(batches) == 2:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        BookImporter(feed, batch_size=3, progress=stop_after_two).run()
+    assert stored_ids() == ['b{:03d}'.format(i) for i in range(6)]
+
+    status = BookImporter(feed, batch_size=3).run(resume=True)
+    assert (status.imported, status.rejected, status.line) == (4, 1, 11)
+    assert stored_ids() == ['b{:03d}'.format(i) for i in range(10)]
+    # a finished feed resumes to nothing, a fresh run starts over and finds every row already there
+    assert BookImporter(feed, batch_size=3).run(resume=True).imported == 0
+    status = BookImporter(feed, batch_size=3).run()
+    assert (status.imported, status.rejected) == (0, 11)
+
+
+def test_rows_the_database_refuses_are_retried_one_by_one(library, tmp_path):
+    with model.engine.begin() as connection:
+        connection.execute(text("CREATE TRIGGER no_cursed BEFORE INSERT ON books WHEN NEW.title = 'cursed' "
+                                "BEGIN SELECT RAISE(ABORT, 'cursed book'); END"))
+    feed = write_feed(tmp_path / 'books.csv', [book_line(0), book_line(1, 'cursed'), book_line(2),
+                                               book_line(3), book_line(4, 'cursed'), book_line(5)])
+    status = library.import_books(feed, batch_size=3)
+    assert (status.imported, status.rejected, status.line) == (4, 2, 6)
+    assert stored_ids() == ['b000', 'b002', 'b003', 'b005']
+    assert [(line, book_id) for line, reason, book_id in rejects(status.reject_path)] == [(2, 'b001'), (5, 'b004')]
+    assert 'cursed book' in rejects(status.reject_path)[0][1]
+    # the good rows of a refused batch are indexed and hashed like any other
+    assert [row.id for row in search_books(text='book 3', use_cache=False)] == ['b003']
+    with model.engine.connect() as connection:
+        assert connection.execute(select([func.count()]).select_from(book_hashes)).scalar() == 4
@@ -0,0 +1,142 @@
+from datetime import date, timedelta
+import threading
+
+import pytest
+from sqlalchemy import select
+
+import model
+from model import *
+from journal import Journal
+
+
+CARDS = [{'id': 'c{}'.format(i), 'name': 'reader', 'dept': 'cs', 'type': 'student'} for i in range(2)]
+BOOKS = [{'id': 'b{}'.format(i), 'type': 'novel', 'title': 'book {}'.format(i), 'publisher': 'ace', 'year': 2000,
+          'author': 'someone', 'price': 10, 'total': 1, 'stock': 1} for i in range(4)]
+
+
+def history():
+    with model.engine.connect() as connection:
+        return [(row.kind, row.card_id, row.book_id) for row in connection.execute(
+            select([circulation_events]).order_by(circulation_events.c.id))]
+
+
+def circulate(admin):
+    due = date.today() + timedelta(days=14)
+    admin.borrow_book('c0', 'b0', due)
+    admin.borrow_books('c1', [('b1', due), ('b2', due)])
+    with pytest.raises(ForbiddenOperationError):
+        admin.borrow_book('c0', 'b1', due)
+    admin.return_book('c0', 'b0')
+    admin.return_books('c1', ['b1'])
+    admin.remove_card('c1')
+
+
+EXPECTED = [('borrow', 'c0', 'b0'), ('borrow', 'c1', 'b1'), ('borrow', 'c1', 'b2'), ('return', 'c0', 'b0'),
+            ('return', 'c1', 'b1'), ('removed', 'c1', 'b2')]
+
+
+@pytest.mark.parametrize('mode', ['sync', 'batched'])
+def test_every_loan_is_journaled(library, mode):
+    configure_journal(mode=mode, flush_interval=30)
+    circulate(library)
+    model.journal.flush()
+    assert history() == EXPECTED
+    with model.engine.connect() as connection:
+        event = connection.execute(select([circulation_events])
+                                   .where(circulation_events.c.kind == 'return')).first()
+    assert event.admin_id == 'desk' and event.borrow_date == date.today()
+    assert event.return_date == date.today() + timedelta(days=14)
+    if mode == 'batched':
+        # one flush wrote the lot
+        assert model.journal.stats()['batches'] == 1
+
+
+def test_off_keeps_no_history(library):
+    configure_journal(mode='off')
+    circulate(library)
+    assert history() == []
+
+
+def test_spill_and_replay(library, tmp_path):
+    down = threading.Event()
+    down.set()
+
+    def store(events):
+        if down.is_set():
+            raise ConnectionError('database unreachable')
+        return store_events(events)
+
+    spill = str(tmp_path / 'journal.jsonl')
+    model.journal = Journal(store, mode='spill', spill_path=spill, flush_interval=30)
+    circulate(library)
+    model.journal.flush()
+    assert history() == [] and model.journal.stats()['spilled'] == 6
+
+    with open(spill) as lines:
+        spilled = lines.read()
+    down.clear()
+    assert model.journal.replay() == 6
+    assert history() == EXPECTED
+    assert model.journal.replay() == 0
+    # replaying events that already reached the database doesn't repeat them
+    with open(spill, 'w') as lines:
+        lines.write(spilled)
+    assert model.journal.replay() == 6
+    assert history() == EXPECTED
+
+
+def test_spills_are_replayed_when_the_database_returns(library, tmp_path):
+    down = threading.Event()
+    down.set()
+
+    def store(events):
+        if down.is_set():
+            raise ConnectionError('database unreachable')
+        return store_events(events)
+
+    model.journal = Journal(store, mode='spill', spill_path=str(tmp_path / 'journal.jsonl'), flush_interval=30)
+    due = date.today() + timedelta(days=14)
+    library.borrow_book('c0', 'b0', due)
+    model.journal.flush()
+    down.clear()
+    library.borrow_book('c0', 'b1', due)
+    model.journal.flush()
+    assert sorted(history()) == [('borrow', 'c0', 'b0'), ('borrow', 'c0', 'b1')]
+    stats = model.journal.stats()
+    assert stats['spilled'] == stats['replayed'] == 1 and stats['written'] == 1
+
+
+def test_full_queue_pushes_back(library, tmp_path):
+    release = threading.Event()
+    stored = []
+
+    def slow_store(events):
+        release.wait()
+        stored.extend(events)
+
+    events = [{'event_id': str(i), 'kind': 'borrow', 'happened': date.today()} for i in range(8)]
+    batched = Journal(slow_store, batch_size=1, max_pending=2, block_timeout=0.01)
+    batched.emit(events)
+    assert 0 < batched.stats()['dropped'] < 8
+    release.set()
+    batched.flush()
+    assert len(stored) + batched.stats()['dropped'] == 8
+
+    release.clear()
+    stored.clear()
+    spilling = Journal(slow_store, mode='spill', batch_size=1, max_pending=2, block_timeout=0.01,
+                       spill_path=str(tmp_path / 'overflow.jsonl'))
+    spilling.emit(events)
+    assert spilling.stats()['dropped'] == 0 and spilling.stats()['spilled'] > 0
+    release.set()
+    spilling.flush()
+    spilling.replay()
+    assert sorted(event['event_id'] for event in stored) == sorted(event['event_id'] for event in events)
+    assert stored[-1]['happened'] == date.today()
+
+
+def test_bad_settings():
+    with pytest.raises(ValueError):
+        Journal(store_events, mode='eventually')
+    with pytest.raises(ValueError):
+        Journal(store_events, mode='spill')
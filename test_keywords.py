@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import distinct, func, select
+
+import model
+from model import *
+
+# title words weigh 3, author words 2 and publisher words 1
+BOOKS = [{'id': 'k1', 'title': 'Database Systems', 'author': 'Ullman', 'publisher': 'Pearson', 'price': 1,
+          'total': 1, 'stock': 1},
+         {'id': 'k2', 'title': 'Distributed Systems', 'author': 'Tanenbaum', 'publisher': 'Pearson', 'price': 1,
+          'total': 1, 'stock': 1},
+         {'id': 'k3', 'title': 'Data and Reality', 'author': 'Kent', 'publisher': 'Database Press', 'price': 1,
+          'total': 1, 'stock': 1},
+         {'id': 'k4', 'title': 'Systems of Data', 'author': 'Data', 'publisher': None, 'price': 1, 'total': 1,
+          'stock': 1},
+         {'id': 'k5', 'title': 'x_ray and 100% proof', 'author': None, 'publisher': None, 'price': 1, 'total': 1,
+          'stock': 1},
+         {'id': 'k6', 'title': 'xyray', 'author': None, 'publisher': None, 'price': 1, 'total': 1, 'stock': 1}]
+
+
+def ranked(text, mode):
+    return [(row.id, row.score) for row in search_books(text=text, text_mode=mode, use_cache=False)]
+
+
+@pytest.mark.parametrize('text, mode, expected', [
+    ('data', 'token', [('k4', 5), ('k3', 3)]),
+    ('DATA', 'token', [('k4', 5), ('k3', 3)]),
+    ('database', 'token', [('k1', 3), ('k3', 1)]),
+    ('data', 'prefix', [('k4', 5), ('k3', 4), ('k1', 3)]),
+    ('dat sys', 'prefix', [('k4', 8), ('k1', 6)]),
+    ('ystem', 'prefix', []),
+    ('ystem', 'substring', [('k1', 3), ('k2', 3), ('k4', 3)]),
+    ('ata pear', 'substring', [('k1', 4)]),
+    # LIKE wildcards in a word match themselves only
+    ('x_r', 'substring', [('k5', 3)]),
+    ('100', 'token', [('k5', 3)]),
+])
+def test_modes_and_ranking(library, text, mode, expected):
+    assert ranked(text, mode) == expected
+
+
+def test_ranked_pages(library):
+    first = search_books(text='data', text_mode='prefix', page_size=2, use_cache=False)
+    rest = search_books(text='data', text_mode='prefix', page_size=2, cursor=first.cursor, use_cache=False)
+    assert [row.id for row in first] + [row.id for row in rest] == ['k4', 'k3', 'k1']
+    assert rest.cursor is None
+    # an explicit order replaces the ranking
+    assert [row.id for row in search_books(text='data', order_by=books.c.id, use_cache=False)] == ['k1', 'k3', 'k4']
+
+
+def test_no_words_and_bad_modes(library):
+    assert len(search_books(text='  !! ', use_cache=False)) == len(BOOKS)
+    with pytest.raises(ValueError):
+        search_books(text='data', text_mode='fuzzy')
+
+
+def test_substrings_match_the_words_indexed_since(library):
+    assert ranked('eali', 'substring') == [('k3', 3)]
+    realism = {'id': 'k7', 'title': 'Realism', 'price': 1, 'total': 1, 'stock': 1}
+    with model.engine.begin() as connection:
+        connection.execute(books.insert(), realism)
+        model._index_books(connection, [realism])
+    assert ranked('eali', 'substring') == [('k3', 3), ('k7', 3)]
+    # the vocabulary holds each indexed word once
+    with model.engine.connect() as connection:
+        words = connection.execute(select([func.count()]).select_from(indexed_terms)).scalar()
+        assert words == connection.execute(select([func.count(distinct(book_terms.c.term))])).scalar()
+
+
+def test_rebuild_drops_cached_pages(library):
+    assert [row.id for row in search_books(text='reality')] == ['k3']
+    with model.engine.begin() as connection:
+        connection.execute(books.update().where(books.c.id == 'k2').values(title='Distributed Reality'))
+    rebuild_text_index(batch_size=2)
+    assert [row.id for row in search_books(text='reality')] == ['k2', 'k3']
+    assert [row.id for row in search_books(text='distributed systems', use_cache=False)] == []
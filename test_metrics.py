@@ -0,0 +1,91 @@
+from threading import Thread
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+import model
+from model import *
+
+
+# every statement counts as slow
+pytestmark = pytest.mark.parametrize('library', [{'slow_query_ms': 0}], indirect=True, ids=['slow_query_ms=0'])
+
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+BOOKS = [{'id': 'b1', 'title': 'data systems', 'price': 1, 'total': 1, 'stock': 1}]
+
+
+@pytest.fixture
+def recorded(library):
+    metrics.reset()
+    return metrics
+
+
+def test_operations_and_statements_are_recorded(recorded):
+    search_books(title='data systems', use_cache=False)
+    Admin.list_borrows('1')
+    with pytest.raises(NotFoundError):
+        Admin.list_borrows('nobody')
+
+    snapshot = recorded.snapshot()
+    assert snapshot['operations']['search_books']['count'] == 1
+    assert snapshot['operations']['search_books']['rows'] == 1
+    assert snapshot['operations']['list_borrows']['count'] == 2
+    assert snapshot['queries']['select']['count'] >= 3
+    # every checkout is timed, through the router and the engine alike
+    assert snapshot['pool_wait']['count'] >= 3
+    assert snapshot['pool_hold']['count'] >= 3
+    # every statement is slow with a zero threshold, and is tagged with its operation
+    assert snapshot['slow_count'] == snapshot['queries']['select']['count']
+    assert {entry['operation'] for entry in snapshot['slow_queries']} == {'search_books', 'list_borrows'}
+
+
+def test_failed_statement_does_not_skew_timings(recorded):
+    with model.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.execute(text('SELECT * FROM missing_table'))
+        assert not connection.info.get('metrics_query_start')
+        connection.execute(text('SELECT 1'))
+    assert recorded.snapshot()['queries']['select']['count'] == 1
+
+
+def test_prometheus_dump(recorded):
+    search_books(use_cache=False)
+    dump = recorded.to_prometheus()
+    assert 'library_operation_seconds_count{operation="search_books"} 1' in dump
+    assert 'library_operation_seconds_bucket{operation="search_books",le="+Inf"} 1' in dump
+    assert 'library_pool_wait_seconds_count' in dump
+    assert 'library_pool_hold_seconds_count' in dump
+    assert dump.endswith('\n')
+
+
+def test_connection_holds_are_timed_across_dispose(recorded):
+    model.engine.dispose()
+    with model.engine.connect() as connection:
+        time.sleep(0.02)
+        connection.execute(text('SELECT 1'))
+    hold = recorded.snapshot()['pool_hold']
+    assert hold['count'] == 1 and hold['max_ms'] >= 20
+
+
+def test_waits_for_a_pooled_connection_are_timed(recorded, tmp_path):
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'pool.db'), poolclass=QueuePool, pool_size=1,
+                           max_overflow=0)
+    held = engine.connect()
+
+    def release():
+        time.sleep(0.05)
+        held.close()
+
+    releaser = Thread(target=release)
+    releaser.start()
+    # the only connection is out until the other thread gives it back
+    recorded.timed_connect(engine).close()
+    releaser.join()
+    wait = recorded.snapshot()['pool_wait']
+    assert wait['count'] == 1 and wait['max_ms'] >= 40
+
+    with model.engine.begin() as connection:
+        connection.execute(text('SELECT 1'))
+    assert recorded.snapshot()['pool_wait']['count'] == 2
@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+import re
+
+import pytest
+from sqlalchemy import event, text
+
+import model
+from model import *
+
+# tables the hot queries must never read end to end
+LARGE_TABLES = ('books', 'borrows', 'book_terms')
+
+
+CARDS = [{'id': str(i), 'name': 'reader', 'dept': 'cs', 'type': 'student'} for i in range(20)]
+BOOKS = [{'id': 'b{:04d}'.format(i), 'type': 'type{}'.format(i % 5), 'title': 'title {}'.format(i),
+          'publisher': 'publisher{}'.format(i % 7), 'year': 1950 + i % 70, 'author': 'author{}'.format(i % 11),
+          'price': i % 100, 'total': 3, 'stock': 3} for i in range(500)]
+
+
+@pytest.fixture(scope='module')
+def library(shared_library):
+    with model.engine.begin() as connection:
+        connection.execute(text('ANALYZE'))
+    for card_id in ('1', '2'):
+        shared_library.borrow_book(card_id, 'b0001', date.today() + timedelta(days=14))
+    return shared_library
+
+
+def captured(action):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(model.engine, 'before_cursor_execute', capture)
+    try:
+        action()
+    finally:
+        event.remove(model.engine, 'before_cursor_execute', capture)
+    assert statements
+    return statements
+
+
+def full_scans(statement, parameters, ordered_walk=False):
+    # an ordered walk reads an index in ORDER BY order and stops at the LIMIT,
+    # so only a scan of the table itself counts; otherwise walking a whole index does too
+    with model.engine.connect() as connection:
+        if model.engine.dialect.name == 'mysql':
+            plan = connection.execute('EXPLAIN ' + statement, parameters).fetchall()
+            return [row.table for row in plan
+                    if row.table in LARGE_TABLES and (row.type == 'ALL' or row.type == 'index' and not ordered_walk)]
+        plan = connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        scans = []
+        for row in plan:
+            match = re.match(r'SCAN (?:TABLE )?(\w+)(.*)', row[-1])
+            if match and match.group(1) in LARGE_TABLES and ('USING' not in match.group(2) or not ordered_walk):
+                scans.append(match.group(1))
+        return scans
+
+
+CANONICAL_QUERIES = {
+    'type': lambda admin: search_books(type='type1', page_size=20, use_cache=False),
+    'title': lambda admin: search_books(title='title 7', use_cache=False),
+    'author': lambda admin: search_books(author='author3', page_size=20, use_cache=False),
+    'publisher': lambda admin: search_books(publisher='publisher2', page_size=20, use_cache=False),
+    'year range': lambda admin: search_books(year=(1990, 2000), page_size=20, use_cache=False),
+    'price range': lambda admin: search_books(price=(10, 20), page_size=20, use_cache=False),
+    'type and year': lambda admin: search_books(type='type2', year=(1960, 1970), page_size=20, use_cache=False),
+    'order by title': lambda admin: search_books(order_by=books.c.title, page_size=20, use_cache=False),
+    'order by year desc': lambda admin: search_books(order_by=desc(books.c.year), page_size=20, use_cache=False),
+    'order by price': lambda admin: search_books(order_by=books.c.price, page_size=20, use_cache=False),
+    'keywords': lambda admin: search_books(text='title', text_mode='prefix', page_size=20, use_cache=False),
+    # the LIKE scans indexed_terms, the short list of distinct words, and only seeks book_terms
+    'keyword substrings': lambda admin: search_books(text='itl', text_mode='substring', page_size=20, use_cache=False),
+    'nearest return': lambda admin: admin.find_nearest_return('b0001'),
+    'availability': lambda admin: availability('b0001'),
+    'list borrows': lambda admin: admin.list_borrows('1'),
+    'list borrows page': lambda admin: admin.list_borrows(card_ids=['1', '2'], page_size=20),
+    'list borrows dept': lambda admin: admin.list_borrows(dept='cs', page_size=20),
+    'return book': lambda admin: admin.return_book('1', 'b0001'),
+}
+ORDERED_WALKS = {'order by title', 'order by year desc', 'order by price'}
+
+
+@pytest.mark.parametrize('name', sorted(CANONICAL_QUERIES))
+def test_hot_queries_use_indexes(library, name):
+    for statement, parameters in captured(lambda: CANONICAL_QUERIES[name](library)):
+        assert full_scans(statement, parameters, name in ORDERED_WALKS) == [], statement
+
+
+@pytest.mark.parametrize('order_by', [books.c.title, books.c.price, desc(books.c.price)], ids=str)
+def test_next_pages_seek_to_the_cursor(library, order_by):
+    # reading the order's index from its start up to the cursor would cost more on every page
+    cursor = search_books(order_by=order_by, page_size=20, use_cache=False).cursor
+    for statement, parameters in captured(
+            lambda: search_books(order_by=order_by, page_size=20, cursor=cursor, use_cache=False)):
+        assert full_scans(statement, parameters) == [], statement
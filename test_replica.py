@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import model
+from model import *
+from replica import LocalReplica
+
+
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+
+
+@pytest.fixture
+def library(library):
+    # added through the model so that the change log has them
+    for i in range(3):
+        Admin.add_book(id='b{}'.format(i), title='book {}'.format(i), author='author', price=1, total=2, stock=2)
+    return library
+
+
+def local_stock(replica, book_id):
+    with replica.engine.connect() as connection:
+        return connection.execute(select([books.c.stock]).where(books.c.id == book_id)).scalar()
+
+
+def test_pulls_everything_once_then_only_changes(library, tmp_path):
+    replica = LocalReplica(str(tmp_path / 'catalog.db'))
+    assert replica.sync() == 3
+    assert replica.version == 3
+    assert replica.sync() == 0
+
+    Admin(id='desk').borrow_book('1', 'b1', date.today() + timedelta(days=14))
+    Admin.add_book(id='b3', title='book 3', author='author', price=1, total=1, stock=1)
+    assert replica.sync() == 2
+    assert (local_stock(replica, 'b1'), local_stock(replica, 'b3')) == (1, 1)
+
+    # a new process picks up where the file left off
+    assert LocalReplica(str(tmp_path / 'catalog.db')).sync() == 0
+
+
+def test_search_from_the_copy(library, tmp_path):
+    replica = LocalReplica(str(tmp_path / 'catalog.db'))
+    replica.sync()
+    with model.engine.begin() as connection:
+        connection.execute(books.update().where(books.c.id == 'b0').values(title='renamed'))
+    replica.attach(prefer=True)
+    assert [row.id for row in search_books(text='book 0', use_cache=False)] == ['b0']
+
+    # the primary goes away, searches keep working from the copy
+    configure('sqlite:///{}'.format(tmp_path / 'unreachable' / 'library.db'))
+    replica.attach()
+    assert len(search_books(use_cache=False)) == 3
+    assert [row.id for row in search_books(text='book', page_size=2, use_cache=False)] == ['b0', 'b1']
+
+
+def test_trimmed_log_forces_a_full_pull(library, tmp_path):
+    replica = LocalReplica(str(tmp_path / 'catalog.db'))
+    replica.sync()
+    Admin(id='desk').borrow_book('1', 'b1', date.today() + timedelta(days=14))
+    Admin.return_book('1', 'b1')
+    trim_change_log(keep=1)
+    assert replica.sync() == 3
+    assert local_stock(replica, 'b1') == 2
+
+
+def test_late_commits_are_picked_up(library, tmp_path):
+    replica = LocalReplica(str(tmp_path / 'catalog.db'))
+    replica.sync()
+    Admin(id='desk').borrow_book('1', 'b1', date.today() + timedelta(days=14))
+    Admin(id='desk').borrow_book('1', 'b2', date.today() + timedelta(days=14))
+    # hide the first borrow's book entry as if its transaction had not committed yet
+    entry = changes_since(3, 'books')[0]
+    with model.engine.begin() as connection:
+        connection.execute(change_log.delete().where(change_log.c.version == entry.version))
+    assert replica.sync() == 1
+    assert local_stock(replica, 'b1') == 2
+
+    with model.engine.begin() as connection:
+        connection.execute(change_log.insert().values(version=entry.version, table_name='books', row_id='b1'))
+    assert replica.sync() == 1
+    assert local_stock(replica, 'b1') == 1
@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+import json
+import csv
+
+import pytest
+
+import model
+from model import *
+from report import export_report, report_query
+
+
+TODAY = date.today()
+CARDS = [{'id': 's1', 'name': 'ann', 'dept': 'cs', 'type': 'student'},
+         {'id': 's2', 'name': 'bob', 'dept': 'math', 'type': 'student'},
+         {'id': 't1', 'name': 'cyd', 'dept': 'cs', 'type': 'teacher'}]
+BOOKS = [{'id': 'b1', 'title': 'one', 'price': 1, 'total': 5, 'stock': 2},
+         {'id': 'b2', 'title': 'two', 'price': 1, 'total': 5, 'stock': 4}]
+BORROWS = [{'card_id': 's1', 'book_id': 'b1', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=40),
+            'return_date': TODAY - timedelta(days=10)},
+           {'card_id': 's2', 'book_id': 'b1', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=20),
+            'return_date': TODAY - timedelta(days=1)},
+           {'card_id': 't1', 'book_id': 'b1', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=2),
+            'return_date': TODAY + timedelta(days=12)},
+           {'card_id': 't1', 'book_id': 'b2', 'admin_id': 'desk', 'borrow_date': TODAY - timedelta(days=2),
+            'return_date': TODAY + timedelta(days=12)}]
+
+
+def test_overdue_report_in_csv(library, tmp_path):
+    path = str(tmp_path / 'overdue.csv')
+    progress = []
+    assert export_report('overdue', path, chunk_size=1, progress=progress.append) == 2
+    assert progress == [1, 2]
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [(row['card_id'], row['book_id'], row['title']) for row in rows] == [('s1', 'b1', 'one'),
+                                                                                 ('s2', 'b1', 'one')]
+    assert rows[0]['return_date'] == (TODAY - timedelta(days=10)).isoformat()
+
+    assert export_report('overdue', path, start=TODAY - timedelta(days=30)) == 1
+
+
+def test_circulation_and_popular_reports_in_json(library, tmp_path):
+    path = str(tmp_path / 'circulation.json')
+    assert export_report('circulation', path) == 3
+    with open(path) as file:
+        rows = json.load(file)
+    assert rows == [{'card_type': 'student', 'dept': 'cs', 'loans': 1, 'cards': 1, 'titles': 1, 'overdue': 1},
+                    {'card_type': 'student', 'dept': 'math', 'loans': 1, 'cards': 1, 'titles': 1, 'overdue': 1},
+                    {'card_type': 'teacher', 'dept': 'cs', 'loans': 2, 'cards': 1, 'titles': 2, 'overdue': 0}]
+
+    path = str(tmp_path / 'popular.json')
+    assert export_report('popular', path, end=TODAY - timedelta(days=1)) == 2
+    with open(path) as file:
+        rows = json.load(file)
+    assert [(row['id'], row['loans']) for row in rows] == [('b1', 3), ('b2', 1)]
+
+    assert export_report('popular', path, start=TODAY) == 0
+    with open(path) as file:
+        assert json.load(file) == []
+
+
+def test_returned_loans_still_count(library, tmp_path):
+    configure_journal('sync')
+    library.borrow_book('s2', 'b2', TODAY + timedelta(days=7))
+    Admin.return_book('s2', 'b2')
+    # a loan from last month that came back five days late
+    borrowed = model._loan_event('borrow', 's1', 'b2', 'desk', TODAY - timedelta(days=30), TODAY - timedelta(days=20))
+    returned = dict(borrowed, event_id='late', kind='return', happened=datetime.now() - timedelta(days=15))
+    store_events([borrowed, returned])
+
+    path = str(tmp_path / 'circulation.json')
+    assert export_report('circulation', path) == 3
+    with open(path) as file:
+        rows = json.load(file)
+    assert rows == [{'card_type': 'student', 'dept': 'cs', 'loans': 2, 'cards': 1, 'titles': 2, 'overdue': 2},
+                    {'card_type': 'student', 'dept': 'math', 'loans': 2, 'cards': 1, 'titles': 2, 'overdue': 1},
+                    {'card_type': 'teacher', 'dept': 'cs', 'loans': 2, 'cards': 1, 'titles': 2, 'overdue': 0}]
+
+    path = str(tmp_path / 'popular.json')
+    assert export_report('popular', path) == 2
+    with open(path) as file:
+        rows = json.load(file)
+    assert [(row['id'], row['loans']) for row in rows] == [('b1', 3), ('b2', 3)]
+    assert export_report('popular', path, end=TODAY - timedelta(days=1)) == 2
+    with open(path) as file:
+        assert [(row['id'], row['loans']) for row in json.load(file)] == [('b1', 3), ('b2', 2)]
+
+
+def test_bad_parameters(library, tmp_path):
+    with pytest.raises(ValueError):
+        report_query('nonsense')
+    with pytest.raises(ValueError):
+        report_query('overdue', start=TODAY, end=TODAY - timedelta(days=1))
+    with pytest.raises(ValueError):
+        export_report('overdue', str(tmp_path / 'overdue.xlsx'))
@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+import shutil
+import time
+
+import pytest
+
+import model
+from model import *
+
+
+def titles():
+    return sorted(row.title for row in search_books(use_cache=False))
+
+
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+BOOKS = [{'id': 'b1', 'title': 'shared', 'price': 1, 'total': 2, 'stock': 2}]
+
+
+@pytest.fixture
+def primary(library):
+    write_heartbeat()
+    return model.engine.url.database
+
+
+def replicate(primary, tmp_path, name, title=None):
+    # a file copy stands in for replication; an extra book tells the copies apart
+    path = tmp_path / name
+    shutil.copy(str(primary), str(path))
+    if title is not None:
+        engine = model.create_engine('sqlite:///{}'.format(path))
+        engine.execute(books.insert().values(id=name, title=title, price=1, total=1, stock=1))
+        engine.dispose()
+    return 'sqlite:///{}'.format(path)
+
+
+def test_reads_rotate_over_replicas(primary, tmp_path):
+    replicas = [replicate(primary, tmp_path, 'r1.db', 'only on r1'),
+                replicate(primary, tmp_path, 'r2.db', 'only on r2')]
+    configure('sqlite:///{}'.format(primary), replica_urls=replicas, pin_seconds=0)
+    seen = {tuple(titles()) for _ in range(4)}
+    assert seen == {('only on r1', 'shared'), ('only on r2', 'shared')}
+
+
+def test_writes_pin_reads_to_the_primary(primary, tmp_path):
+    replica = replicate(primary, tmp_path, 'r1.db')
+    configure('sqlite:///{}'.format(primary), replica_urls=[replica], pin_seconds=60)
+    assert availability('b1').stock == 2
+    Admin(id='desk').borrow_book('1', 'b1', date.today() + timedelta(days=14))
+    # the replica has not seen the checkout, the primary has
+    assert availability('b1').stock == 1
+    assert Admin.find_nearest_return('b1') == date.today() + timedelta(days=14)
+    router.pinned_until = 0
+    assert availability('b1').stock == 2
+
+
+def test_failover_to_the_primary(primary, tmp_path):
+    missing = 'sqlite:///{}'.format(tmp_path / 'no such dir' / 'replica.db')
+    replica = replicate(primary, tmp_path, 'r1.db', 'only on r1')
+    configure('sqlite:///{}'.format(primary), replica_urls=[missing], pin_seconds=0)
+    assert titles() == ['shared']
+    assert router.replicas[0].down_until > time.monotonic()
+
+    configure('sqlite:///{}'.format(primary), replica_urls=[missing, replica], pin_seconds=0)
+    assert all(titles() == ['only on r1', 'shared'] for _ in range(4))
+
+
+def test_stale_replicas_are_skipped(primary, tmp_path):
+    replica = replicate(primary, tmp_path, 'r1.db', 'only on r1')
+    with model.create_engine(replica).begin() as connection:
+        connection.execute(heartbeats.update().values(beat=time.time() - 120))
+    configure('sqlite:///{}'.format(primary), replica_urls=[replica], max_replica_lag=30, pin_seconds=0)
+    assert titles() == ['shared']
+    assert router.replicas[0].lag >= 120
+
+    with model.create_engine(replica).begin() as connection:
+        connection.execute(heartbeats.update().values(beat=time.time()))
+    router.replicas[0].lag_checked = 0
+    assert titles() == ['only on r1', 'shared']
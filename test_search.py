@@ -0,0 +1,104 @@
+import base64
+
+import pytest
+
+from model import *
+
+# years repeat and a third of them are missing, so pages break inside runs of equal and null values
+BOOKS = [{'id': 'b{:02d}'.format(i), 'type': ['novel', 'textbook'][i % 2], 'title': 'book {}'.format(i),
+          'year': None if i % 3 == 0 else 1990 + i % 4, 'price': [10, 20, 30][i % 3], 'total': 1, 'stock': 1}
+         for i in range(20)]
+
+
+def ids(rows):
+    return [row.id for row in rows]
+
+
+def walk(page_size, **params):
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = search_books(page_size=page_size, cursor=cursor, use_cache=False, **params)
+        assert len(page) <= page_size
+        seen.extend(ids(page))
+        pages += 1
+        cursor = page.cursor
+        if cursor is None:
+            return seen, pages
+
+
+def expected(key):
+    return [book['id'] for book in sorted(BOOKS, key=key)]
+
+
+@pytest.mark.parametrize('page_size', [1, 3, 7, 20])
+def test_pages_across_nulls(library, page_size):
+    # nulls sort first ascending and last descending, ties go by id
+    seen, pages = walk(page_size, order_by=books.c.year)
+    assert seen == expected(lambda book: (book['year'] is not None, book['year'] or 0, book['id']))
+    assert pages == -(-len(BOOKS) // page_size)
+
+    seen, pages = walk(page_size, order_by=desc(books.c.year))
+    assert seen == expected(lambda book: (book['year'] is None, -(book['year'] or 0), book['id']))
+
+    seen, pages = walk(page_size, order_by=[desc(books.c.price), books.c.year], type='novel')
+    assert seen == expected(lambda book: (book['type'] != 'novel', -book['price'], book['year'] is not None,
+                                          book['year'] or 0, book['id']))[:10]
+
+
+def test_last_page_has_no_cursor(library):
+    assert search_books(page_size=20).cursor is None
+    page = search_books(page_size=19)
+    assert ids(search_books(page_size=19, cursor=page.cursor)) == ['b19']
+
+
+@pytest.mark.parametrize('payload', [b'5', b'null', b'{"a":1}', b'["b01"]', b'[1990,"b01","b02"]',
+                                     b'[{"d":"ten"},"b01"]', b'[{"t":"never"},"b01"]', b'[[1990],"b01"]'])
+def test_tampered_cursors(library, payload):
+    with pytest.raises(ValueError):
+        search_books(order_by=books.c.year, page_size=3, cursor=base64.urlsafe_b64encode(payload).decode())
+
+
+def test_malformed_cursors(library):
+    cursor = search_books(order_by=books.c.year, page_size=3).cursor
+    for bad in ('garbage!', cursor[:-3], ''):
+        with pytest.raises(ValueError):
+            search_books(order_by=books.c.year, page_size=3, cursor=bad)
+    # a cursor only fits the order it came from
+    with pytest.raises(ValueError):
+        search_books(order_by=[books.c.year, books.c.price], page_size=3, cursor=cursor)
+
+
+def test_streamed_chunks_make_up_the_whole_result(library):
+    for params in ({'order_by': books.c.id}, {'order_by': [desc(books.c.year), books.c.id]},
+                   {'type': 'textbook', 'order_by': [books.c.price, books.c.id]}):
+        whole = ids(search_books(use_cache=False, **params))
+        chunks = list(search_books(stream=True, chunk_size=3, **params))
+        assert all(0 < len(chunk) <= 3 for chunk in chunks)
+        assert [row.id for chunk in chunks for row in chunk] == whole
+
+
+@pytest.mark.parametrize('current', [{'type': 'novel', 'text': 'book', 'year': (1991, 1992)},
+                                     {'type': 'novel', 'text': 'book', 'price': 20},
+                                     {'type': 'novel', 'text': 'book 1'}, {'type': 'novel', 'text': 'book 1 boo'}])
+def test_refine_narrows_a_complete_page(library, current):
+    previous = {'type': 'novel', 'text': 'book'}
+    page = search_books(**previous)
+    refined = refine_search(previous, page, current)
+    assert refined is not None and refined.cursor is None
+    assert ids(refined) == ids(search_books(use_cache=False, **current))
+
+
+def test_refine_falls_back_to_the_database(library):
+    previous = {'type': 'novel'}
+    partial = search_books(page_size=5, **previous)
+    assert partial.cursor is not None
+    # rows past the first page may match too
+    assert refine_search(previous, partial, {'type': 'novel', 'price': 20}) is None
+
+    page = search_books(**previous)
+    assert refine_search(previous, page, {'type': 'novel', 'price': 20}) is not None
+    # loosened or changed criteria, and a new order a page of rows can't be sorted into
+    for current in ({}, {'type': 'textbook'}, {'price': 20}, dict(previous, order_by=books.c.year)):
+        assert refine_search(previous, page, current) is None
+    ranged = {'year': (1990, 1992)}
+    assert refine_search(ranged, search_books(**ranged), {'year': (1989, 1992)}) is None
@@ -0,0 +1,88 @@
+from collections import namedtuple
+from datetime import date, timedelta
+import time
+
+from model import *
+
+Row = namedtuple('Row', ['id', 'title'])
+
+BOOKS = [{'id': 'b{}'.format(i), 'type': ['novel', 'textbook'][i % 2], 'title': 'book {}'.format(i),
+          'price': [30, 10, 20, 40][i], 'total': 2, 'stock': 2} for i in range(4)]
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+
+
+def page(*book_ids):
+    return BookPage([Row(book_id, 'book') for book_id in book_ids])
+
+
+def ids(rows):
+    return [row.id for row in rows]
+
+
+def test_least_recently_used_goes_first():
+    cache = SearchCache(max_entries=2)
+    cache.put('a', page('b1'))
+    cache.put('b', page('b2'))
+    assert ids(cache.get('a')) == ['b1']
+    cache.put('c', page('b3'))
+    assert cache.get('b') is None
+    assert ids(cache.get('a')) == ['b1'] and ids(cache.get('c')) == ['b3']
+    assert cache.stats()['evictions'] == 1 and cache.stats()['entries'] == 2
+
+
+def test_entries_expire():
+    cache = SearchCache(ttl=0.05)
+    cache.put('a', page('b1'))
+    assert cache.get('a') is not None
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_large_pages_are_not_kept():
+    cache = SearchCache(max_rows=2)
+    large = page('b1', 'b2', 'b3')
+    assert cache.put('a', large) is large
+    assert cache.get('a') is None
+    cache.put('b', page('b1', 'b2'))
+    assert ids(cache.get('b')) == ['b1', 'b2']
+
+
+def test_evicting_a_book_drops_only_its_pages():
+    cache = SearchCache()
+    cache.put('a', page('b1', 'b2'))
+    cache.put('b', page('b2', 'b3'))
+    cache.put('c', page('b4'))
+    cache.evict_books(['b2'])
+    assert cache.get('a') is None and cache.get('b') is None
+    assert ids(cache.get('c')) == ['b4']
+    # nothing is left pointing at the dropped pages
+    cache.evict_books(['b1', 'b3'])
+    assert cache.stats()['evictions'] == 2
+
+
+def test_checkouts_and_returns_evict_the_pages_showing_the_book(library):
+    novels = search_books(type='novel')
+    textbooks = search_books(type='textbook')
+    assert ids(novels) == ['b0', 'b2'] and ids(textbooks) == ['b1', 'b3']
+
+    library.borrow_book('1', 'b0', date.today() + timedelta(days=14))
+    hits = search_cache.stats()['hits']
+    assert [row.stock for row in search_books(type='novel')] == [1, 2]
+    assert search_cache.stats()['hits'] == hits
+    assert search_books(type='textbook').rows == textbooks.rows
+    assert search_cache.stats()['hits'] == hits + 1
+
+    Admin.return_book('1', 'b0')
+    assert [row.stock for row in search_books(type='novel')] == [2, 2]
+    assert search_books(type='textbook').rows == textbooks.rows
+    assert search_cache.stats()['hits'] == hits + 2
+
+
+def test_expression_orders_do_not_share_pages(library):
+    # the two orders compile to the same text with different bound values
+    low = search_books(order_by=[desc(books.c.price > 5), books.c.id])
+    high = search_books(order_by=[desc(books.c.price > 25), books.c.id])
+    assert ids(low) == ['b0', 'b1', 'b2', 'b3']
+    assert ids(high) == ids(search_books(order_by=[desc(books.c.price > 25), books.c.id], use_cache=False))
+    assert ids(high) == ['b0', 'b3', 'b1', 'b2']
@@ -0,0 +1,47 @@
+from threading import Barrier, Thread
+
+import pytest
+from sqlalchemy import select
+
+import model
+from model import *
+
+
+def card_ids():
+    with model.engine.connect() as connection:
+        return [row.id for row in connection.execute(select([cards.c.id]).order_by(cards.c.id))]
+
+
+def test_commits_on_success_and_rolls_back_on_error(library):
+    with session_scope() as current:
+        current.add(Card(id='kept', name='reader', type='student'))
+    with pytest.raises(RuntimeError):
+        with session_scope() as current:
+            current.add(Card(id='lost', name='reader', type='student'))
+            current.flush()
+            raise RuntimeError('desk closed')
+    assert card_ids() == ['kept']
+    # the thread's session is gone either way
+    assert not session.registry.has()
+
+    # the failed unit of work leaves nothing behind for the next one
+    with session_scope() as current:
+        current.add(Card(id='next', name='reader', type='student'))
+    assert card_ids() == ['kept', 'next']
+
+
+def test_each_thread_has_its_own_session(library):
+    barrier = Barrier(2)
+    seen = []
+
+    def use():
+        with session_scope() as current:
+            seen.append(current)
+            barrier.wait()
+
+    threads = [Thread(target=use) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == 2 and seen[0] is not seen[1]
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from sqlalchemy import inspect
+
+import model
+from model import *
+
+
+def test_import_loads_no_driver():
+    code = ('import sys, model\n'
+            'assert not model.engine.resolved\n'
+            'print(sorted(name for name in ("pymysql", "sqlalchemy_utils") if name in sys.modules))\n')
+    output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_engine_is_created_on_first_use(tmp_path):
+    configure('sqlite:///{}'.format(tmp_path / 'library.db'))
+    assert not model.engine.resolved
+    assert model.engine.url.database.endswith('library.db')
+    assert router.primary is None
+    prepare_db()
+    assert model.engine.resolved
+    assert router.primary is model.engine.resolve()
+
+
+def test_stamped_schema_skips_preparation(tmp_path):
+    url = 'sqlite:///{}'.format(tmp_path / 'library.db')
+    configure(url)
+    assert prepare_db()
+    assert not prepare_db()
+    configure(url)
+    assert not prepare_db()
+    with model.engine.begin() as connection:
+        assert connection.execute(schema_versions.select()).fetchall()[0].version == schema_fingerprint()
+        # a database prepared for other models, or missing an index, gets the full treatment again
+        connection.execute(schema_versions.update().values(version='old'))
+        connection.execute('DROP INDEX ix_books_title')
+    assert prepare_db()
+    assert 'ix_books_title' in {index['name'] for index in inspect(model.engine.resolve()).get_indexes('books')}
+    assert not prepare_db()
@@ -0,0 +1,119 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import func
+
+import model
+from model import *
+
+
+CARDS = [{'id': 'c{}'.format(i), 'name': 'reader', 'dept': 'cs', 'type': 'student'} for i in range(3)]
+BOOKS = [{'id': 'b{:02d}'.format(i), 'type': ['novel', 'textbook'][i % 2], 'title': 'title_{}'.format(i),
+          'publisher': ['ace', 'mit', 'tor'][i % 3], 'year': None if i % 4 == 0 else 1990 + i % 10,
+          'author': 'author {}'.format(i % 5), 'price': 10 + i, 'total': 2, 'stock': 2} for i in range(40)]
+
+
+@pytest.fixture
+def cache(library, monkeypatch):
+    monkeypatch.setattr(model, 'statement_cache', StatementCache(max_entries=8))
+    return model.statement_cache
+
+
+def ids(rows):
+    return [row.id for row in rows]
+
+
+def uncached(monkeypatch, action):
+    monkeypatch.setattr(model, 'statement_cache', StatementCache(max_entries=0))
+    return action()
+
+
+def walk(**params):
+    seen, cursor = [], None
+    while True:
+        page = search_books(page_size=7, cursor=cursor, use_cache=False, **params)
+        seen.extend(ids(page))
+        cursor = page.cursor
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize('params', [{'type': 'novel'}, {'year': (1991, 1996), 'price': 31},
+                                    {'publisher': 'mit', 'order_by': desc(books.c.year)},
+                                    {'text': 'title_1', 'text_mode': 'substring'}, {'text': 'auth 3'}])
+def test_same_shape_new_values(cache, monkeypatch, params):
+    searches = [dict(params), dict(params)]
+    for name in ('type', 'publisher', 'price'):
+        if name in params:
+            searches[1][name] = {'type': 'textbook', 'publisher': 'tor', 'price': 33}[name]
+    if 'text' in params:
+        searches[1]['text'] = params['text'].replace('1', '2').replace('3', '4')
+    cached = [walk(**search) for search in searches]
+    assert cache.stats()['hits'] > 0
+    assert cached == uncached(monkeypatch, lambda: [walk(**search) for search in searches])
+    assert cached[0] and cached[0] != cached[1]
+
+
+def test_cursor_through_nulls(cache, monkeypatch):
+    # the first pages end on a null year, later ones on a value: two shapes of the same query
+    cached = walk(order_by=books.c.year)
+    assert cache.stats()['entries'] == 3
+    assert cached == uncached(monkeypatch, lambda: walk(order_by=books.c.year))
+    assert len(cached) == 40
+
+
+def test_expressions_are_not_cached(cache):
+    search_books(order_by=func.lower(books.c.title), use_cache=False)
+    search_books(order_by=func.lower(books.c.author), use_cache=False)
+    assert cache.stats()['entries'] == 0
+
+
+def test_loans_and_returns(library, cache):
+    due = date.today() + timedelta(days=7)
+    for card_id, book_id in (('c0', 'b01'), ('c1', 'b02'), ('c1', 'b03'), ('c2', 'b04')):
+        library.borrow_book(card_id, book_id, due)
+    assert ids(Admin.list_borrows(card_ids=['c0', 'c1'])) == ['b01', 'b02', 'b03']
+    assert ids(Admin.list_borrows(card_ids=['c1', 'c2', 'c9'])) == ['b02', 'b03', 'b04']
+    assert ids(Admin.list_borrows('c2')) == ['b04']
+    assert ids(Admin.list_borrows('c0')) == ['b01']
+    assert Admin.find_nearest_return('b02') == due
+    assert Admin.find_nearest_return('b05') is None
+    hits = cache.stats()['hits']
+    assert Admin.find_nearest_return('b04') == due
+    assert cache.stats()['hits'] == hits + 1
+
+
+def test_size_limit(cache):
+    for page_size in range(1, 13):
+        search_books(type='novel', page_size=page_size, use_cache=False)
+    stats = cache.stats()
+    assert stats['entries'] == 8 and stats['evictions'] == 4 and stats['misses'] == 12
+    # compiled forms go with their statements
+    assert stats['compiled'] == 8
+    cache.clear()
+    assert cache.stats()['entries'] == cache.stats()['compiled'] == 0
+
+
+def test_unpaged_orders_break_ties_by_id(cache):
+    # one shape, whether or not the id is spelled out
+    by_year = ids(search_books(order_by=desc(books.c.year), use_cache=False))
+    by_year_and_id = ids(search_books(order_by=[desc(books.c.year), books.c.id], use_cache=False))
+    assert cache.stats()['entries'] == 1
+    assert by_year == by_year_and_id == [book['id'] for book in sorted(
+        BOOKS, key=lambda book: (book['year'] is None, -(book['year'] or 0), book['id']))]
+
+
+def test_one_off_statements_stay_out_of_the_compiled_cache(cache):
+    for limit in range(20):
+        search_books(order_by=[desc(books.c.price > limit), books.c.id], use_cache=False)
+    assert cache.stats()['entries'] == cache.stats()['compiled'] == 0
+
+
+def test_compiled_forms_are_bounded():
+    forms = model._CompiledForms(max_entries=2)
+    for name in ('a', 'b', 'c'):
+        forms[(None, name)] = name
+    assert forms.get((None, 'a')) is None and len(forms) == 2
+    assert forms.get((None, 'b')) == 'b'
+    forms[(None, 'd')] = 'd'
+    assert forms.get((None, 'c')) is None
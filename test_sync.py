@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import model
+from model import *
+
+CARDS = [{'id': '1', 'name': 'reader', 'type': 'student'}]
+
+
+def write_feed(path, books):
+    with open(str(path), 'w') as feed:
+        for book_id, title, total in books:
+            feed.write('({}, novel, {}, ace, 1999, someone, 9.50, {})\n'.format(book_id, title, total))
+    return str(path)
+
+
+def catalog():
+    with model.engine.connect() as connection:
+        return {row.id: (row.title, row.total, row.stock)
+                for row in connection.execute(select([books.c.id, books.c.title, books.c.total, books.c.stock]))}
+
+
+def test_only_new_and_changed_rows_are_written(library, tmp_path):
+    feed = write_feed(tmp_path / 'feed.csv', [('b0', 'zero', 2), ('b1', 'one', 2), ('b2', 'two', 2)])
+    status = library.sync_books(feed)
+    assert (status.imported, status.updated, status.unchanged) == (3, 0, 0)
+    library.borrow_book('1', 'b1', date.today() + timedelta(days=14))
+
+    feed = write_feed(tmp_path / 'feed.csv', [('b0', 'zero', 2), ('b1', 'one', 5), ('b2', 'two again', 2),
+                                              ('b3', 'three', 1)])
+    status = library.sync_books(feed)
+    assert (status.imported, status.updated, status.unchanged, status.rejected) == (1, 2, 1, 0)
+    # stock is the new total less the copy out on loan
+    assert catalog() == {'b0': ('zero', 2, 2), 'b1': ('one', 5, 4), 'b2': ('two again', 2, 2),
+                         'b3': ('three', 1, 1)}
+    assert [row.id for row in search_books(text='again', use_cache=False)] == ['b2']
+    assert search_books(text='two', use_cache=False).rows[0].id == 'b2'
+
+    status = library.sync_books(feed)
+    assert (status.imported, status.updated, status.unchanged) == (0, 0, 4)
+
+
+def test_total_below_the_copies_on_loan_is_rejected(library, tmp_path):
+    library.sync_books(write_feed(tmp_path / 'feed.csv', [('b0', 'zero', 2)]))
+    library.borrow_book('1', 'b0', date.today() + timedelta(days=14))
+    with model.engine.begin() as connection:
+        connection.execute(cards.insert().values(id='2', name='reader', type='student'))
+    library.borrow_book('2', 'b0', date.today() + timedelta(days=14))
+    status = library.sync_books(write_feed(tmp_path / 'feed.csv', [('b0', 'zero', 1)]))
+    assert (status.updated, status.rejected) == (0, 1)
+    assert catalog() == {'b0': ('zero', 2, 0)}
+
+
+def test_retiring_spares_books_on_loan(library, tmp_path):
+    library.sync_books(write_feed(tmp_path / 'feed.csv', [('b0', 'zero', 1), ('b1', 'one', 1), ('b2', 'two', 1)]))
+    library.borrow_book('1', 'b1', date.today() + timedelta(days=14))
+    status = library.sync_books(write_feed(tmp_path / 'feed.csv', [('b2', 'two', 1)]), retire_missing=True)
+    assert (status.retired, status.unchanged) == (1, 1)
+    assert sorted(catalog()) == ['b1', 'b2']
+    assert search_books(text='zero', use_cache=False).rows == []
+    with pytest.raises(ValueError):
+        library.sync_books(write_feed(tmp_path / 'feed.csv', []), retire_missing=True, resume=True)
+
+    Admin.return_book('1', 'b1')
+    status = library.sync_books(write_feed(tmp_path / 'feed.csv', [('b2', 'two', 1)]), retire_missing=True)
+    assert status.retired == 1
+    assert sorted(catalog()) == ['b2']
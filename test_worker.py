@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+pytest.importorskip('kivy')
+import library as desk
+
+
+class ManualClock:
+    # stands in for the Kivy clock: scheduled callbacks run when the test ticks
+    def __init__(self):
+        self.callbacks = []
+
+    def schedule_once(self, callback, timeout=0):
+        self.callbacks.append(callback)
+
+    def tick(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = ManualClock()
+    monkeypatch.setattr(desk, 'Clock', clock)
+    return clock
+
+
+def test_only_the_latest_result_is_delivered(clock):
+    worker = desk.Worker(max_workers=2)
+    release = threading.Event()
+    results, errors = [], []
+    worker.submit('search', lambda: release.wait(5) and 'old', results.append, errors.append)
+    worker.submit('search', lambda: 'new', results.append, errors.append)
+    release.set()
+    # shutting down waits for both calls and their done callbacks
+    worker.executor.shutdown(wait=True)
+    assert len(clock.callbacks) == 2
+    clock.tick()
+    assert results == ['new'] and errors == []
+
+
+def test_errors_and_cancelled_tasks(clock):
+    worker = desk.Worker(max_workers=1)
+    release = threading.Event()
+    results, errors = [], []
+    worker.submit('blocker', release.wait, results.append, errors.append, 5)
+    worker.submit('fail', lambda: 1 / 0, results.append, errors.append)
+    worker.submit('load_more', lambda: 'dropped', results.append, errors.append)
+    worker.cancel('load_more')
+    release.set()
+    worker.executor.shutdown(wait=True)
+    clock.tick()
+    assert results == [True]
+    assert len(errors) == 1 and isinstance(errors[0], ZeroDivisionError)
+    assert worker.pending == {}